@@ -1,78 +1,84 @@
-import json
+import asyncio
 import secrets
 from typing import Optional, Dict, Any
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, status, Depends, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pathlib import Path
-import hashlib
 import time
+from .config import Config
+from .user_store import UserStore, create_user_store, hash_api_key
+from .limiter import user_rate_limiter
 
 security = HTTPBearer()
 
 class AuthManager:
-    """Менеджер аутентификации с хранением в JSON"""
+    """Менеджер аутентификации поверх хранилища пользователей"""
     
-    def __init__(self, users_file: Path = Path("users.json")):
-        self.users_file = users_file
-        self.users_file.parent.mkdir(exist_ok=True)
+    # Обращения к хранилищу выполняются вне event loop: запись ждет блокировку SQLite до busy_timeout,
+    # а проверка ключа читает только индекс в памяти
     
-    def _load_users(self) -> Dict[str, Any]:
-        """Загружает пользователей из JSON файла"""
-        try:
-            with open(self.users_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {"users": []}
+    def __init__(self, store: Optional[UserStore] = None):
+        self.store = store or create_user_store()
+        # Индекс sha256(api_key) -> пользователь; перестраивается при смене версии хранилища
+        self._index: Dict[str, Dict[str, Any]] = {}
+        self._store_version = None
+        # Время последнего использования копится в памяти и сбрасывается в хранилище пачкой
+        self._pending_last_used: Dict[str, float] = {}
+        self._reload_index()
     
-    def _save_users(self, data: Dict[str, Any]):
-        """Сохраняет пользователей в JSON файл"""
-        with open(self.users_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+    def _reload_index(self, force: bool = False):
+        """Перестраивает индекс, если пользователи изменились (синхронно)"""
+        version = self.store.version()
+        if force or version != self._store_version or not self._index:
+            self._index = {user["api_key_hash"]: user for user in self.store.all() if user.get("api_key_hash")}
+            self._store_version = version
+    
+    async def refresh_index(self, force: bool = False):
+        """Перечитывает изменения пользователей (в том числе сделанные другими воркерами) вне event loop"""
+        await asyncio.to_thread(self._reload_index, force)
+    
+    async def flush_last_used(self) -> int:
+        """Записывает накопленное время последнего использования ключей; возвращает число пользователей"""
+        if not self._pending_last_used:
+            return 0
+        pending, self._pending_last_used = self._pending_last_used, {}
+        await asyncio.to_thread(self.store.touch, pending)
+        return len(pending)
     
     def _generate_api_key(self) -> str:
         """Генерирует случайный API ключ"""
         return secrets.token_urlsafe(32)
     
     def verify_api_key(self, api_key: str) -> Optional[Dict[str, Any]]:
-        """Проверяет API ключ и возвращает данные пользователя"""
-        data = self._load_users()
-        
-        for user in data.get("users", []):
-            if user.get("api_key") == api_key and user.get("is_active", True):
-                # Обновляем время последнего использования
-                user["last_used"] = time.time()
-                self._save_users(data)
-                return user
-        
-        return None
+        """Проверяет API ключ и возвращает данные пользователя (без обращения к диску)"""
+        user = self._index.get(hash_api_key(api_key))
+        if user is None or not user.get("is_active", True):
+            return None
+        
+        # Время последнего использования попадет в хранилище при следующем сбросе
+        now = time.time()
+        user["last_used"] = now
+        self._pending_last_used[user["username"]] = now
+        return dict(user)
     
-    def create_user(self, username: str, is_admin: bool = False, rate_limit: int = 100) -> str:
+    async def create_user(self, username: str, is_admin: bool = False, rate_limit: int = 100, priority: int = 0) -> str:
         """Создает нового пользователя и возвращает API ключ"""
-        data = self._load_users()
-        
-        # Проверяем, что username уникален
-        for user in data.get("users", []):
-            if user.get("username") == username:
-                raise ValueError(f"Пользователь {username} уже существует")
-        
-        # Создаем нового пользователя
+        # Ключ показывается один раз, в хранилище попадает только его хэш
         api_key = self._generate_api_key()
-        new_user = {
+        await asyncio.to_thread(self.store.create, {
             "username": username,
-            "api_key": api_key,
+            "api_key_hash": hash_api_key(api_key),
             "is_admin": is_admin,
             "created_at": time.time(),
             "last_used": None,
             "rate_limit": rate_limit,
+            "priority": priority,
             "is_active": True
-        }
-        
-        data["users"].append(new_user)
-        self._save_users(data)
+        })
+        await self.refresh_index(force=True)
         
         return api_key
     
-    def delete_user(self, username: str, current_user: Dict[str, Any]) -> bool:
+    async def delete_user(self, username: str, current_user: Dict[str, Any]) -> bool:
         """Удаляет пользователя (только для администраторов)"""
         if not current_user.get("is_admin"):
             raise PermissionError("Только администраторы могут удалять пользователей")
@@ -81,73 +87,60 @@ class AuthManager:
         if current_user.get("username") == username:
             raise ValueError("Нельзя удалить собственный аккаунт")
         
-        data = self._load_users()
-        initial_length = len(data.get("users", []))
-        
-        data["users"] = [user for user in data.get("users", []) 
-                        if user.get("username") != username]
-        
-        if len(data["users"]) == initial_length:
+        if not await asyncio.to_thread(self.store.delete, username):
             return False  # Пользователь не найден
         
-        self._save_users(data)
+        self._pending_last_used.pop(username, None)
+        await self.refresh_index(force=True)
         return True
     
-    def get_users(self, current_user: Dict[str, Any]) -> list:
+    async def get_users(self, current_user: Dict[str, Any]) -> list:
         """Возвращает список пользователей (только для администраторов)"""
         if not current_user.get("is_admin"):
             raise PermissionError("Только администраторы могут просматривать список пользователей")
         
-        data = self._load_users()
-        # Не возвращаем API ключи в списке
+        users = await asyncio.to_thread(self.store.all)
+        # Не возвращаем хэши ключей в списке
         return [
             {
                 "username": user.get("username"),
                 "is_admin": user.get("is_admin", False),
                 "created_at": user.get("created_at"),
-                "last_used": user.get("last_used"),
+                # Еще не сброшенное в хранилище время использования тоже учитываем
+                "last_used": self._pending_last_used.get(user.get("username"), user.get("last_used")),
                 "rate_limit": user.get("rate_limit", 100),
+                "priority": user.get("priority", 0),
                 "is_active": user.get("is_active", True)
             }
-            for user in data.get("users", [])
+            for user in users
         ]
     
-    def update_user(self, username: str, updates: Dict[str, Any], current_user: Dict[str, Any]) -> bool:
+    async def update_user(self, username: str, updates: Dict[str, Any], current_user: Dict[str, Any]) -> bool:
         """Обновляет данные пользователя (только для администраторов)"""
         if not current_user.get("is_admin"):
             raise PermissionError("Только администраторы могут обновлять пользователей")
         
-        data = self._load_users()
-        user_found = False
-        
-        for user in data.get("users", []):
-            if user.get("username") == username:
-                # Не позволяем изменять API ключ через этот метод
-                updates.pop("api_key", None)
-                user.update(updates)
-                user_found = True
-                break
+        # Не позволяем изменять API ключ через этот метод
+        updates.pop("api_key", None)
+        updates.pop("api_key_hash", None)
+        user_found = await asyncio.to_thread(self.store.update, username, **updates)
         
         if user_found:
-            self._save_users(data)
+            await self.refresh_index(force=True)
         
         return user_found
 
-    def regenerate_api_key(self, username: str, current_user: Dict[str, Any]) -> str:
+    async def regenerate_api_key(self, username: str, current_user: Dict[str, Any]) -> str:
         """Генерирует новый API ключ для пользователя"""
         if not current_user.get("is_admin") and current_user.get("username") != username:
             raise PermissionError("Можно обновлять только свой ключ")
         
-        data = self._load_users()
-        
-        for user in data.get("users", []):
-            if user.get("username") == username:
-                new_api_key = self._generate_api_key()
-                user["api_key"] = new_api_key
-                self._save_users(data)
-                return new_api_key
+        new_api_key = self._generate_api_key()
+        if not await asyncio.to_thread(self.store.update, username, api_key_hash=hash_api_key(new_api_key)):
+            raise ValueError(f"Пользователь {username} не найден")
         
-        raise ValueError(f"Пользователь {username} не найден")
+        await self.refresh_index(force=True)
+        return new_api_key
 
 # Глобальный экземпляр менеджера аутентификации
 auth_manager = AuthManager()
@@ -181,4 +174,20 @@ async def verify_admin(user: Dict[str, Any] = Depends(verify_api_key)) -> Dict[s
             detail="Admin privileges required"
         )
     
-    return user
\ No newline at end of file
+    return user
+
+async def enforce_rate_limit(response: Response, user: Dict[str, Any] = Depends(verify_api_key)) -> Dict[str, Any]:
+    """Зависимость для проверки лимита запросов пользователя (поле rate_limit)"""
+    result = await user_rate_limiter.check_requests(user)
+    if result is None:
+        return user
+    
+    if not result.allowed:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Rate limit exceeded",
+            headers=result.headers()
+        )
+    
+    response.headers.update(result.headers())
+    return user
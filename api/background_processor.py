@@ -1,6 +1,5 @@
 import asyncio
-import io
-import zipfile
+import time
 from typing import List
 from fastapi import UploadFile
 from .task_manager import task_manager
@@ -8,86 +7,127 @@ from .processors.async_white_processor import AsyncWhiteProcessor
 from .processors.async_interior_processor import AsyncInteriorProcessor
 from .models.schemas import TaskStatus
 from .logging import CustomLogger
+from .streaming import StreamingZipWriter
+from .result_store import result_store, ResultTooLargeError
+from .metrics import task_seconds, files_processed_total
+from .events import FINAL_STATUSES, task_events
+from .task_outputs import task_outputs
 
 class BackgroundProcessor:
     """Обработчик фоновых задач"""
     
     async def process_task(self, task_id: str):
         """Обрабатывает задачу в фоновом режиме"""
-        task = task_manager.get_task(task_id)
+        task = await task_manager.get_task(task_id)
         if not task:
             return
+        if task["status"] in FINAL_STATUSES:
+            # Задачу уже завершили (например, пометили прерванной), пока она ждала в очереди
+            task_manager.release_inputs(task_id)
+            return
         
-        # Создаем логгер для задачи
         processing_type = "white" if task["white_bg"] else "interior"
-        logger = CustomLogger(processing_type)
-        task_manager.update_task_status(task_id, TaskStatus.PROCESSING, logger=logger)
+        logger = None
+        started = time.perf_counter()
         
         try:
+            # Создаем логгер для задачи
+            logger = CustomLogger(processing_type)
+            await task_manager.update_task_status(task_id, TaskStatus.PROCESSING, logger=logger)
+            
             logger.info(f"Начало фоновой обработки задачи {task_id}")
             logger.info(f"Файлов для обработки: {task['total_files']}")
             
             # Выбираем процессор
             if task["white_bg"]:
-                processor = AsyncWhiteProcessor()
+                processor = AsyncWhiteProcessor(owner=task_id)
             else:
-                processor = AsyncInteriorProcessor()
+                processor = AsyncInteriorProcessor(owner=task_id)
             
-            # Обрабатываем файлы
-            zip_buffer = await self._process_with_progress(processor, task["files"], task_id, logger)
+            # Обрабатываем файлы, дописывая архив по мере готовности
+            writer = StreamingZipWriter(result_store.staging_path(task_id))
+            try:
+                await self._process_with_progress(
+                    processor, task["files"], task_id, logger, task["concurrency"], writer
+                )
+                archive_path = await writer.finalize()
+            except BaseException:
+                writer.abort()
+                raise
             
             # Сохраняем результат
-            task_manager.set_task_result(task_id, zip_buffer)
-            task_manager.update_task_status(task_id, TaskStatus.COMPLETED, progress=100)
+            result_key = await result_store.put(task_id, archive_path)
+            await task_manager.set_task_result(task_id, result_key)
+            await task_manager.update_task_status(task_id, TaskStatus.COMPLETED, progress=100)
+            # Файлы по одному теперь отдаются из архива: второй копии на диске не держим
+            await asyncio.to_thread(task_outputs.remove, task_id)
             
             logger.info(f"Фоновая обработка завершена успешно: {task_id}")
             logger.finish_success(
                 processed_count=task["total_files"],
                 task_id=task_id
             )
-            
+        
         except Exception as e:
             error_msg = f"Ошибка фоновой обработки: {str(e)}"
-            logger.error(error_msg)
-            task_manager.set_task_error(task_id, error_msg)
-            logger.finish_error(error=error_msg, task_id=task_id)
+            await task_manager.set_task_error(task_id, error_msg)
+            if isinstance(e, ResultTooLargeError):
+                # Файлы задачи, не поместившейся в лимит, не должны занимать место других задач
+                await asyncio.to_thread(task_outputs.remove, task_id)
+            # Логгер мог не создаться: тогда ошибка остается только в статусе задачи
+            if logger is not None:
+                logger.error(error_msg)
+                logger.finish_error(error=error_msg, task_id=task_id)
+        
+        finally:
+            task_seconds.labels(processing_type).observe(time.perf_counter() - started)
+            # Загруженные файлы больше не нужны, не держим их до очистки задачи
+            task_manager.release_inputs(task_id)
     
-    async def _process_with_progress(self, processor, files: List[UploadFile], task_id: str, logger: CustomLogger) -> io.BytesIO:
-        """Обрабатывает файлы с обновлением прогресса"""
+    async def _process_with_progress(self, processor, files: List[UploadFile], task_id: str, logger: CustomLogger, concurrency: int, writer: StreamingZipWriter):
+        """Обрабатывает файлы параллельно, дописывая архив и прогресс по мере завершения"""
         total_files = len(files)
-        processed_files = []
+        completed = 0
+        logger.info(f"Параллелизм задачи {task_id}: {concurrency}")
         
-        for i, file in enumerate(files):
-            try:
-                # Обновляем прогресс
-                progress = int((i / total_files) * 100)
-                task_manager.update_task_status(
-                    task_id, 
-                    TaskStatus.PROCESSING, 
-                    progress=progress,
-                    processed_files=i
-                )
-                
-                logger.info(f"Обработка файла {i+1}/{total_files}: {file.filename}")
-                
-                # Обрабатываем файл
-                processed_data, filename = await processor.process_single(file)
-                processed_files.append((filename, processed_data))
-                
-                logger.debug(f"Успешно обработан: {file.filename}")
-                
-            except Exception as e:
-                logger.error(f"Ошибка обработки файла {file.filename}: {e}")
+        # Прогресс обновляется в порядке завершения, а не в порядке файлов
+        async for file, result, error in processor.process_stream(files, concurrency, logger):
+            completed += 1
+            
+            files_processed_total.labels(processor.processing_type, "ok" if error is None else "error").inc()
+            output = None
+            if error is None:
+                processed_data, filename = result
+                # Файл доступен для скачивания сразу, не дожидаясь архива всей задачи;
+                # в архиве он лежит под тем же именем, что и по одному
+                output = await task_outputs.put(task_id, filename, processed_data)
+                await writer.append(output, processed_data)
+                # Лимит места проверяется по мере записи, а не только при сохранении архива
+                await result_store.reserve(task_id)
+                logger.debug("Успешно обработан: %s", file.filename)
+            else:
+                logger.error(f"Ошибка обработки файла {file.filename}: {error}")
                 # Продолжаем обработку остальных файлов
+            
+            if task_events.has_subscribers(task_id):
+                task_events.publish(task_id, "file", {
+                    "filename": file.filename,
+                    "output": output,
+                    "success": error is None,
+                    "error": None if error is None else str(error),
+                    "processed_files": completed,
+                    "total_files": total_files
+                })
+            
+            await task_manager.update_task_status(
+                task_id,
+                TaskStatus.PROCESSING,
+                progress=int((completed / total_files) * 100),
+                processed_files=completed
+            )
         
-        # Создаем ZIP архив
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for filename, file_data in processed_files:
-                zip_file.writestr(filename, file_data)
-        
-        zip_buffer.seek(0)
-        return zip_buffer
+        for stats in processor.stage_stats.values():
+            logger.info(f"Стадия {stats.name} задачи {task_id}: {stats.summary()}")
 
 # Глобальный экземпляр обработчика
 background_processor = BackgroundProcessor()
\ No newline at end of file
@@ -0,0 +1,159 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+from .config import Config
+
+class ResultCache:
+    """Двухуровневый кэш результатов обработки: LRU в памяти и каталог на диске"""
+    
+    def __init__(self, memory_max_bytes: int, disk_dir: Path, disk_max_bytes: int, enabled: bool = True):
+        self.enabled = enabled
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_dir = Path(disk_dir)
+        self.disk_max_bytes = disk_max_bytes
+        
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        # Объем дискового уровня на момент последней записи (None - еще не считали)
+        self._disk_entries: Optional[int] = None
+        self._disk_bytes: Optional[int] = None
+        self._disk_lock = threading.Lock()
+        
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def make_key(image_digest: str, **params) -> str:
+        """Ключ кэша: SHA-256 содержимого изображения (hex, посчитан при приеме загрузки) и параметры обработки"""
+        params_json = json.dumps(params, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(f"{image_digest}:{params_json}".encode("utf-8")).hexdigest()
+    
+    async def get(self, key: str) -> Optional[bytes]:
+        """Возвращает результат из кэша или None"""
+        if not self.enabled:
+            return None
+        
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return data
+        
+        data = await asyncio.to_thread(self._disk_get, key)
+        if data is not None:
+            self.disk_hits += 1
+            self._memory_put(key, data)
+            return data
+        
+        self.misses += 1
+        return None
+    
+    async def put(self, key: str, data: bytes):
+        """Сохраняет результат в оба уровня кэша"""
+        if not self.enabled:
+            return
+        self._memory_put(key, data)
+        await asyncio.to_thread(self._disk_put, key, data)
+    
+    def _memory_put(self, key: str, data: bytes):
+        if len(data) > self.memory_max_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.evictions += 1
+    
+    def _path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.bin"
+    
+    def _scan_disk(self):
+        """Записи дискового уровня по содержимому каталога, от давно использованных к недавним.
+        Каталог общий для воркеров, поэтому объем считается по нему, а не по своим записям"""
+        entries = []
+        for path in self.disk_dir.glob("*/*.bin"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size))
+        entries.sort()
+        self._disk_entries = len(entries)
+        self._disk_bytes = sum(size for _, _, size in entries)
+        return entries
+    
+    def _disk_get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            # Время изменения - время последнего использования, по нему вытесняют все воркеры
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+    
+    def _disk_put(self, key: str, data: bytes):
+        if len(data) > self.disk_max_bytes:
+            return
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        
+        # Атомарная запись: другие воркеры и потоки не увидят недописанный файл
+        fd, tmp_name = tempfile.mkstemp(prefix=f"{key}.", suffix=".tmp", dir=path.parent)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        
+        with self._disk_lock:
+            entries = self._scan_disk()
+            for _, evicted_path, size in entries:
+                if self._disk_bytes <= self.disk_max_bytes:
+                    break
+                if evicted_path == path:
+                    continue
+                evicted_path.unlink(missing_ok=True)
+                self._disk_bytes -= size
+                self._disk_entries -= 1
+                self.evictions += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий и объем кэша"""
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "disk_entries": self._disk_entries,
+            "disk_bytes": self._disk_bytes
+        }
+
+# Глобальный кэш результатов обработки
+result_cache = ResultCache(
+    memory_max_bytes=Config.RESULT_CACHE_MEMORY_MB * 1024 * 1024,
+    disk_dir=Config.RESULT_CACHE_DIR,
+    disk_max_bytes=Config.RESULT_CACHE_DISK_MB * 1024 * 1024,
+    enabled=Config.RESULT_CACHE_ENABLED
+)
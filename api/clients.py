@@ -0,0 +1,42 @@
+from typing import Optional
+from white.async_pixian_client import AsyncPixianClient
+from interior.async_ai_client import AsyncAIClient
+
+class ClientRegistry:
+    """Реестр клиентов внешних API, живущих все время работы приложения"""
+    
+    def __init__(self):
+        self._pixian: Optional[AsyncPixianClient] = None
+        self._ai: Optional[AsyncAIClient] = None
+    
+    @property
+    def pixian(self) -> AsyncPixianClient:
+        """Общий клиент Pixian.AI"""
+        if self._pixian is None:
+            self._pixian = AsyncPixianClient()
+        return self._pixian
+    
+    @property
+    def ai(self) -> AsyncAIClient:
+        """Общий клиент OpenAI-совместимого API"""
+        if self._ai is None:
+            self._ai = AsyncAIClient()
+        return self._ai
+    
+    async def startup(self):
+        """Создает клиентов и прогревает пулы соединений"""
+        await self.pixian.start()
+        if self._ai is None:
+            self._ai = AsyncAIClient()
+    
+    async def shutdown(self):
+        """Закрывает пулы соединений всех клиентов"""
+        if self._pixian is not None:
+            await self._pixian.close()
+            self._pixian = None
+        if self._ai is not None:
+            await self._ai.close()
+            self._ai = None
+
+# Глобальный реестр клиентов
+client_registry = ClientRegistry()
@@ -0,0 +1,154 @@
+import os
+from pathlib import Path
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class Config:
+    """Конфигурация API"""
+
+    # Пути
+    BASE_DIR = Path(__file__).parent.parent
+    
+    # Хранилище задач, общее для всех воркеров
+    TASKS_DB_PATH = Path(os.getenv("TASKS_DB_PATH", str(BASE_DIR / "temp_api" / "tasks.db")))
+    # Воркер отмечается в хранилище каждые WORKER_HEARTBEAT_INTERVAL секунд; без отметки дольше
+    # TASK_STALE_SECONDS он считается завершившимся, и его незавершенные задачи - прерванными
+    TASK_STALE_SECONDS = int(os.getenv("TASK_STALE_SECONDS", "1800"))
+    WORKER_HEARTBEAT_INTERVAL = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", "60"))
+    
+    # Поток событий задачи (SSE): очередь событий на подписчика; без событий чаще TASK_EVENTS_POLL_INTERVAL
+    # состояние перечитывается из хранилища (задачи других воркеров) и отправляется keep-alive
+    TASK_EVENTS_QUEUE_SIZE = int(os.getenv("TASK_EVENTS_QUEUE_SIZE", "256"))
+    TASK_EVENTS_POLL_INTERVAL = float(os.getenv("TASK_EVENTS_POLL_INTERVAL", "5"))
+    # Webhook о завершении задачи: попытки, таймаут попытки (с); при заданном секрете тело
+    # подписывается HMAC-SHA256 в заголовке X-Signature
+    WEBHOOK_ATTEMPTS = int(os.getenv("WEBHOOK_ATTEMPTS", "5"))
+    WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+    # Webhook принимается только на публичные адреса; WEBHOOK_ALLOWED_HOSTS (через запятую) вместо этого
+    # разрешает только перечисленные хосты, WEBHOOK_ALLOW_PRIVATE=true снимает проверку (для разработки)
+    WEBHOOK_ALLOWED_HOSTS = {host.strip().lower() for host in os.getenv("WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()}
+    WEBHOOK_ALLOW_PRIVATE = os.getenv("WEBHOOK_ALLOW_PRIVATE", "false").lower() == "true"
+
+    # Параллельная обработка задач
+    TASK_CONCURRENCY = int(os.getenv("TASK_CONCURRENCY", "5"))
+    MAX_TASK_CONCURRENCY = int(os.getenv("MAX_TASK_CONCURRENCY", "20"))
+    
+    # Пользователи: sqlite - общая база для всех воркеров (при первом запуске в нее переносится
+    # USERS_FILE), json - прежний файл users.json для одного воркера
+    USER_STORE_BACKEND = os.getenv("USER_STORE_BACKEND", "sqlite")
+    USERS_FILE = Path(os.getenv("USERS_FILE", "users.json"))
+    USERS_DB_PATH = Path(os.getenv("USERS_DB_PATH", str(BASE_DIR / "temp_api" / "users.db")))
+    # Как часто проверять изменения пользователей и сбрасывать last_used (с)
+    AUTH_RELOAD_INTERVAL = float(os.getenv("AUTH_RELOAD_INTERVAL", "2"))
+    AUTH_FLUSH_INTERVAL = float(os.getenv("AUTH_FLUSH_INTERVAL", "30"))
+    
+    # Лимиты пользователей (поле rate_limit): запросов за период USER_RATE_LIMIT_PERIOD (с)
+    # и изображений - в USER_IMAGES_PER_REQUEST раз больше; sqlite - лимиты общие для всех воркеров
+    USER_RATE_LIMIT_PERIOD = float(os.getenv("USER_RATE_LIMIT_PERIOD", "3600"))
+    USER_IMAGES_PER_REQUEST = int(os.getenv("USER_IMAGES_PER_REQUEST", "10"))
+    USER_RATE_LIMIT_BACKEND = os.getenv("USER_RATE_LIMIT_BACKEND", "sqlite")
+    
+    # Прием загрузок: файлы задачи пишутся в ее каталог (0 - без ограничения размера)
+    UPLOADS_DIR = Path(os.getenv("UPLOADS_DIR", str(BASE_DIR / "temp_api" / "uploads")))
+    MAX_UPLOAD_FILE_MB = int(os.getenv("MAX_UPLOAD_FILE_MB", "50"))
+    MAX_UPLOAD_REQUEST_MB = int(os.getenv("MAX_UPLOAD_REQUEST_MB", "2048"))
+    UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+    
+    # Очередь задач обработки
+    QUEUE_MAX_SIZE = int(os.getenv("QUEUE_MAX_SIZE", "100"))
+    QUEUE_WORKERS = int(os.getenv("QUEUE_WORKERS", "4"))
+    QUEUE_RETRY_AFTER = int(os.getenv("QUEUE_RETRY_AFTER", "30"))
+    QUEUE_DRAIN_TIMEOUT = float(os.getenv("QUEUE_DRAIN_TIMEOUT", "60"))
+    
+    # Пул для работы Pillow: process - пул процессов, thread - пул потоков
+    CPU_EXECUTOR = os.getenv("CPU_EXECUTOR", "process")
+    CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(os.cpu_count() or 2)))
+    
+    # Лимиты внешних API на процесс: параллелизм, скорость (запросов/с, 0 - без ограничения) и burst
+    UPSTREAM_LIMITS = {
+        name: {
+            "concurrency": int(os.getenv(f"{prefix}_CONCURRENCY", default_concurrency)),
+            "rate": float(os.getenv(f"{prefix}_RATE", "0")),
+            "burst": int(os.getenv(f"{prefix}_BURST", default_concurrency))
+        }
+        for name, prefix, default_concurrency in (
+            ("pixian", "PIXIAN", "10"),
+            ("chat", "CHAT_MODEL", "10"),
+            ("image", "IMAGE_MODEL", "5")
+        )
+    }
+    # Повторы запросов к внешним API: число попыток, таймаут одной попытки (с)
+    # и задержка перед дублирующим запросом (с, 0 - не дублировать)
+    UPSTREAM_RETRY = {
+        name: {
+            "attempts": int(os.getenv(f"{prefix}_RETRY_ATTEMPTS", default_attempts)),
+            "attempt_timeout": float(os.getenv(f"{prefix}_ATTEMPT_TIMEOUT", default_timeout)),
+            "hedge_after": float(os.getenv(f"{prefix}_HEDGE_AFTER", "0")),
+            "circuit": circuit
+        }
+        for name, prefix, default_attempts, default_timeout, circuit in (
+            ("pixian", "PIXIAN", "3", "60", "pixian"),
+            ("chat", "CHAT_MODEL", "3", "30", "openai"),
+            ("image", "IMAGE_MODEL", "2", "120", "openai")
+        )
+    }
+    RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+    RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "20"))
+    # Дольше этого Retry-After сервера не ждем
+    RETRY_AFTER_MAX = float(os.getenv("RETRY_AFTER_MAX", "60"))
+    # Автоматический выключатель на внешний API: размыкается, если в окне CIRCUIT_WINDOW_SECONDS
+    # из не менее CIRCUIT_MIN_REQUESTS запросов доля ошибок достигла CIRCUIT_FAILURE_RATE;
+    # через CIRCUIT_OPEN_SECONDS пропускает CIRCUIT_HALF_OPEN_PROBES пробных запросов
+    CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", "60"))
+    CIRCUIT_MIN_REQUESTS = int(os.getenv("CIRCUIT_MIN_REQUESTS", "10"))
+    CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+    CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+    CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", "1"))
+    # local - лимит на процесс, sqlite - скорость общая для всех воркеров
+    LIMITER_BACKEND = os.getenv("LIMITER_BACKEND", "local")
+    LIMITER_DB_PATH = Path(os.getenv("LIMITER_DB_PATH", str(BASE_DIR / "temp_api" / "limits.db")))
+    
+    # Кэш результатов обработки
+    RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+    RESULT_CACHE_MEMORY_MB = int(os.getenv("RESULT_CACHE_MEMORY_MB", "256"))
+    RESULT_CACHE_DISK_MB = int(os.getenv("RESULT_CACHE_DISK_MB", "2048"))
+    RESULT_CACHE_DIR = Path(os.getenv("RESULT_CACHE_DIR", str(BASE_DIR / "temp_api" / "cache")))
+    
+    # Архивы результатов задач
+    RESULTS_DIR = Path(os.getenv("RESULTS_DIR", str(BASE_DIR / "temp_api" / "results")))
+    # disk - архивы во временном каталоге, memory - в памяти в пределах бюджета с вытеснением на диск
+    # (memory подходит только для одного воркера: архив доступен лишь процессу, который его создал)
+    RESULT_STORE_BACKEND = os.getenv("RESULT_STORE_BACKEND", "disk")
+    RESULT_MEMORY_BUDGET_MB = int(os.getenv("RESULT_MEMORY_BUDGET_MB", "256"))
+    RESULT_DISK_MAX_MB = int(os.getenv("RESULT_DISK_MAX_MB", "10240"))
+    DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(256 * 1024)))
+    # Готовые файлы задач по одному: сохраняются по мере обработки (для скачивания до завершения задачи),
+    # входят в лимит RESULT_DISK_MAX_MB; удаляются, как только готов итоговый архив (у упавших задач - вместе с задачей).
+    # Пока задача обрабатывается, она занимает около двух своих размеров: файлы и недописанный архив
+    OUTPUTS_DIR = Path(os.getenv("OUTPUTS_DIR", str(BASE_DIR / "temp_api" / "outputs")))
+    # Уже сжатые форматы кладутся в архив без повторного сжатия
+    ZIP_STORED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".gif", ".zip"}
+
+    # Отправка логов из фонового потока: уровень, буфер (записей), пакет, интервал сброса (с);
+    # при переполнении drop вытесняет старые записи, block ждет места до LOG_BLOCK_TIMEOUT
+    # (block действует только в фоновых потоках; вызовы из event loop всегда вытесняют старые записи)
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "info")
+    LOG_BUFFER_SIZE = int(os.getenv("LOG_BUFFER_SIZE", "10000"))
+    LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "100"))
+    LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1"))
+    LOG_OVERFLOW_POLICY = os.getenv("LOG_OVERFLOW_POLICY", "drop")
+    LOG_BLOCK_TIMEOUT = float(os.getenv("LOG_BLOCK_TIMEOUT", "1"))
+    LOG_FLUSH_TIMEOUT = float(os.getenv("LOG_FLUSH_TIMEOUT", "10"))
+
+    # Метрики /metrics (по процессу); если задан токен, он требуется в заголовке Authorization
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+    @classmethod
+    def resolve_concurrency(cls, requested: Optional[int] = None) -> int:
+        """Возвращает допустимый уровень параллелизма для задачи"""
+        if not requested:
+            return cls.TASK_CONCURRENCY
+        return max(1, min(requested, cls.MAX_TASK_CONCURRENCY))
@@ -0,0 +1,86 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Any, Dict, Optional
+
+from .config import Config
+from .metrics import cpu_task_seconds
+
+class CPUExecutor:
+    """Пул для CPU-нагруженной работы с изображениями: процессы, при недоступности - потоки"""
+    
+    def __init__(self, mode: str, workers: int):
+        self.mode = mode
+        self.workers = workers
+        self._executor: Optional[Executor] = None
+        self._timings: Dict[str, Dict[str, float]] = {}
+    
+    def _create_executor(self) -> Executor:
+        if self.mode == "process":
+            try:
+                # spawn: воркеры не наследуют потоки и соединения родителя
+                return ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            except (OSError, NotImplementedError, ValueError):
+                self.mode = "thread"
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="cpu")
+    
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = self._create_executor()
+        return self._executor
+    
+    def _fallback_to_threads(self):
+        """Переключается на пул потоков, если пул процессов сломан"""
+        broken, self._executor = self._executor, None
+        self.mode = "thread"
+        if broken is not None:
+            broken.shutdown(wait=False, cancel_futures=True)
+    
+    async def run(self, fn: Callable, *args) -> Any:
+        """Выполняет функцию в пуле (функция и аргументы должны сериализоваться pickle)"""
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            result = await loop.run_in_executor(self._get_executor(), fn, *args)
+        except BrokenProcessPool:
+            self._fallback_to_threads()
+            result = await loop.run_in_executor(self._get_executor(), fn, *args)
+        self._record(fn.__name__, time.perf_counter() - started)
+        return result
+    
+    def _record(self, name: str, seconds: float):
+        cpu_task_seconds.labels(name).observe(seconds)
+        timing = self._timings.setdefault(name, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        timing["count"] += 1
+        timing["total_seconds"] += seconds
+        timing["max_seconds"] = max(timing["max_seconds"], seconds)
+    
+    def shutdown(self):
+        """Останавливает пул (вызывается при остановке приложения)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+    
+    def stats(self) -> Dict[str, Any]:
+        """Режим пула и время операций (включая ожидание свободного воркера)"""
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "operations": {
+                name: {
+                    "count": timing["count"],
+                    "total_seconds": round(timing["total_seconds"], 3),
+                    "average_seconds": round(timing["total_seconds"] / timing["count"], 4),
+                    "max_seconds": round(timing["max_seconds"], 4)
+                }
+                for name, timing in self._timings.items()
+            }
+        }
+
+# Глобальный пул для обработки изображений
+cpu_executor = CPUExecutor(Config.CPU_EXECUTOR, Config.CPU_WORKERS)
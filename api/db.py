@@ -0,0 +1,14 @@
+import sqlite3
+from pathlib import Path
+
+def connect(path: Path) -> sqlite3.Connection:
+    """Открывает SQLite базу в режиме WAL, пригодном для нескольких воркеров"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    
+    conn = sqlite3.connect(str(path), timeout=30, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
@@ -0,0 +1,72 @@
+import asyncio
+import json
+from typing import Any, Dict, Optional, Set, Tuple
+
+from .config import Config
+from .models.schemas import TaskStatus, TaskStatusResponse
+
+# Событие потока: (тип, данные)
+TaskEvent = Tuple[str, Dict[str, Any]]
+
+FINAL_STATUSES = (TaskStatus.COMPLETED, TaskStatus.FAILED)
+
+def task_snapshot(task: Dict[str, Any], queue_position: Optional[int] = None) -> Dict[str, Any]:
+    """Состояние задачи в том же виде, что и ответ /status"""
+    return TaskStatusResponse(
+        task_id=task["task_id"],
+        status=task["status"],
+        progress=task["progress"],
+        processed_files=task["processed_files"],
+        total_files=task["total_files"],
+        start_time=task["start_time"],
+        end_time=task["end_time"],
+        queue_position=queue_position,
+        error=task["error"]
+    ).model_dump(mode="json")
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Кадр Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+class TaskEventBroker:
+    """Рассылка событий задач подписчикам потока в пределах процесса"""
+    
+    def __init__(self, queue_size: int):
+        self.queue_size = max(1, queue_size)
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self.dropped = 0
+    
+    def has_subscribers(self, task_id: str) -> bool:
+        return task_id in self._subscribers
+    
+    def subscribe(self, task_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        self._subscribers.setdefault(task_id, set()).add(queue)
+        return queue
+    
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(task_id)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[task_id]
+    
+    def publish(self, task_id: str, event: str, data: Dict[str, Any]):
+        """Кладет событие в очереди подписчиков, не дожидаясь их"""
+        for queue in self._subscribers.get(task_id, ()):
+            if queue.full():
+                # Медленный клиент теряет самые старые события: состояние в следующем событии полное
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait((event, data))
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tasks": len(self._subscribers),
+            "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+            "dropped": self.dropped
+        }
+
+# Глобальный брокер событий задач
+task_events = TaskEventBroker(Config.TASK_EVENTS_QUEUE_SIZE)
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import shutil
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import List, Optional
+
+import aiofiles
+from fastapi import UploadFile
+
+from .config import Config
+from .metrics import upload_spool_seconds, upload_bytes_total
+
+class UploadTooLargeError(Exception):
+    """Загрузка превышает допустимый размер файла или запроса"""
+    
+    def __init__(self, message: str, limit: int):
+        super().__init__(message)
+        self.limit = limit
+
+@dataclass
+class SpooledFile:
+    """Загруженный файл, сохраненный в каталог задачи"""
+    filename: str
+    path: Path
+    size: int
+    sha256: str
+    content_type: Optional[str] = None
+    
+    async def read(self) -> bytes:
+        """Читает файл с диска (совместимо с UploadFile.read)"""
+        async with aiofiles.open(self.path, "rb") as f:
+            return await f.read()
+
+class UploadSpool:
+    """Потоковый прием загрузок: файлы пишутся на диск кусками и хэшируются по ходу записи"""
+    
+    # Описание файлов задачи рядом с ними: по нему задачу можно поднять после перезапуска воркера
+    MANIFEST = "manifest.json"
+    
+    def __init__(self, root: Path, max_file_bytes: int, max_request_bytes: int, chunk_size: int):
+        self.root = Path(root)
+        self.max_file_bytes = max_file_bytes
+        self.max_request_bytes = max_request_bytes
+        self.chunk_size = chunk_size
+    
+    def task_dir(self, task_id: str) -> Path:
+        return self.root / task_id
+    
+    async def spool(self, task_id: str, files: List[UploadFile]) -> List[SpooledFile]:
+        """Сохраняет загрузки задачи в ее каталог; при превышении лимитов каталог удаляется"""
+        directory = self.task_dir(task_id)
+        directory.mkdir(parents=True, exist_ok=True)
+        
+        spooled = []
+        total = 0
+        started = time.perf_counter()
+        try:
+            for index, upload in enumerate(files):
+                # Имя на диске не зависит от присланного, исходное хранится отдельно
+                path = directory / f"{index:05d}{Path(upload.filename or '').suffix.lower()}"
+                size, digest = await self._write(upload, path, self.max_request_bytes - total)
+                total += size
+                spooled.append(SpooledFile(
+                    filename=upload.filename,
+                    path=path,
+                    size=size,
+                    sha256=digest,
+                    content_type=upload.content_type
+                ))
+            await self._write_manifest(directory, spooled)
+        except BaseException:
+            self.remove(task_id)
+            raise
+        
+        upload_spool_seconds.observe(time.perf_counter() - started)
+        upload_bytes_total.inc(total)
+        return spooled
+    
+    async def _write(self, upload: UploadFile, path: Path, request_budget: int):
+        """Копирует одну загрузку кусками, проверяя лимиты по мере чтения"""
+        hasher = hashlib.sha256()
+        size = 0
+        await upload.seek(0)
+        
+        async with aiofiles.open(path, "wb") as target:
+            while True:
+                chunk = await upload.read(self.chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if self.max_file_bytes and size > self.max_file_bytes:
+                    raise UploadTooLargeError(
+                        f"File {upload.filename} exceeds {self.max_file_bytes} bytes", self.max_file_bytes
+                    )
+                if self.max_request_bytes and size > request_budget:
+                    raise UploadTooLargeError(
+                        f"Upload exceeds {self.max_request_bytes} bytes per request", self.max_request_bytes
+                    )
+                hasher.update(chunk)
+                await target.write(chunk)
+        
+        return size, hasher.hexdigest()
+    
+    async def _write_manifest(self, directory: Path, spooled: List[SpooledFile]):
+        records = [dict(asdict(item), path=item.path.name) for item in spooled]
+        async with aiofiles.open(directory / self.MANIFEST, "w", encoding="utf-8") as f:
+            await f.write(json.dumps(records, ensure_ascii=False))
+    
+    def load(self, task_id: str) -> Optional[List[SpooledFile]]:
+        """Файлы задачи по описанию в каталоге; None, если загрузок нет или они неполные (синхронно)"""
+        directory = self.task_dir(task_id)
+        try:
+            records = json.loads((directory / self.MANIFEST).read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return None
+        files = [SpooledFile(**dict(record, path=directory / record["path"])) for record in records]
+        if not all(item.path.is_file() for item in files):
+            return None
+        return files
+    
+    def remove(self, task_id: str):
+        """Удаляет каталог с загрузками задачи"""
+        shutil.rmtree(self.task_dir(task_id), ignore_errors=True)
+
+# Глобальный экземпляр приема загрузок
+upload_spool = UploadSpool(
+    Config.UPLOADS_DIR,
+    Config.MAX_UPLOAD_FILE_MB * 1024 * 1024,
+    Config.MAX_UPLOAD_REQUEST_MB * 1024 * 1024,
+    Config.UPLOAD_CHUNK_SIZE
+)
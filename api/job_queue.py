@@ -0,0 +1,159 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Callable, Awaitable, Optional, Dict, Any, List
+
+from .config import Config
+from .background_processor import background_processor
+from .task_manager import task_manager
+from .metrics import queue_wait_seconds
+
+logger = logging.getLogger(__name__)
+
+class QueueFullError(Exception):
+    """Очередь заполнена или останавливается"""
+    
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class JobQueue:
+    """Ограниченная очередь задач обработки с приоритетами и пулом воркеров"""
+    
+    def __init__(self, handler: Callable[[str], Awaitable[None]], max_size: int, workers: int):
+        self.handler = handler
+        self.max_size = max_size
+        self.workers = workers
+        
+        # Элементы: (-приоритет, порядковый номер, task_id, время постановки)
+        self._heap: List[tuple] = []
+        self._counter = itertools.count()
+        self._condition: Optional[asyncio.Condition] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._active: Dict[str, float] = {}
+        self._closing = False
+        
+        self.submitted_total = 0
+        self.rejected_total = 0
+        self.completed_total = 0
+        self.failed_total = 0
+        self.wait_seconds_total = 0.0
+        self.processing_seconds_total = 0.0
+    
+    async def start(self):
+        """Запускает воркеры очереди"""
+        self._condition = asyncio.Condition()
+        self._closing = False
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+    
+    @property
+    def depth(self) -> int:
+        return len(self._heap)
+    
+    def is_full(self) -> bool:
+        return self._closing or len(self._heap) >= self.max_size
+    
+    def _retry_after(self) -> int:
+        """Оценка времени до освобождения места в очереди"""
+        if not self.completed_total:
+            return Config.QUEUE_RETRY_AFTER
+        average = self.processing_seconds_total / self.completed_total
+        return max(1, int(average / self.workers))
+    
+    async def submit(self, task_id: str, priority: int = 0, force: bool = False) -> int:
+        """Ставит задачу в очередь и возвращает ее позицию (1 - следующая);
+        force - без учета лимита (для уже принятых задач, например после перезапуска)"""
+        if self._closing or (not force and self.is_full()):
+            self.rejected_total += 1
+            message = "Server is shutting down" if self._closing else "Processing queue is full"
+            raise QueueFullError(message, self._retry_after())
+        
+        async with self._condition:
+            heapq.heappush(self._heap, (-priority, next(self._counter), task_id, time.monotonic()))
+            self.submitted_total += 1
+            self._condition.notify()
+        return self.position(task_id)
+    
+    def position(self, task_id: str) -> Optional[int]:
+        """Позиция задачи в очереди или None, если ее там нет"""
+        for index, item in enumerate(sorted(self._heap)):
+            if item[2] == task_id:
+                return index + 1
+        return None
+    
+    async def _worker(self):
+        while True:
+            async with self._condition:
+                # При остановке ожидающие задачи не берем: они остаются PENDING и их подхватит следующий воркер
+                while not self._heap or self._closing:
+                    if self._closing:
+                        return
+                    await self._condition.wait()
+                _, _, task_id, enqueued_at = heapq.heappop(self._heap)
+            
+            waited = time.monotonic() - enqueued_at
+            self.wait_seconds_total += waited
+            queue_wait_seconds.observe(waited)
+            self._active[task_id] = time.monotonic()
+            try:
+                await self.handler(task_id)
+            except Exception as e:
+                # Сбой одной задачи не должен останавливать воркер: иначе очередь перестает разбираться
+                self._active.pop(task_id)
+                self.failed_total += 1
+                logger.exception("Processing task %s crashed", task_id)
+                await self._fail_task(task_id, f"Task crashed: {e}")
+            else:
+                self.processing_seconds_total += time.monotonic() - self._active.pop(task_id)
+                self.completed_total += 1
+    
+    async def _fail_task(self, task_id: str, error: str):
+        try:
+            await task_manager.set_task_error(task_id, error)
+            task_manager.release_inputs(task_id)
+        except Exception:
+            logger.exception("Failed to mark task %s as failed", task_id)
+    
+    async def drain(self, timeout: float) -> List[str]:
+        """Прекращает прием задач и ждет завершения начатых; возвращает прерванные задачи.
+        Ожидающие задачи остаются PENDING вместе с загрузками на диске"""
+        if self._condition is None:
+            return []
+        
+        async with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        
+        done, pending = await asyncio.wait(self._worker_tasks, timeout=timeout)
+        for worker in pending:
+            worker.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        
+        interrupted = list(self._active)
+        self._heap.clear()
+        return interrupted
+    
+    def stats(self) -> Dict[str, Any]:
+        """Состояние очереди"""
+        started = self.submitted_total - len(self._heap)
+        return {
+            "depth": len(self._heap),
+            "max_size": self.max_size,
+            "workers": self.workers,
+            "active": len(self._active),
+            "closing": self._closing,
+            "submitted_total": self.submitted_total,
+            "rejected_total": self.rejected_total,
+            "completed_total": self.completed_total,
+            "failed_total": self.failed_total,
+            "average_wait_seconds": round(self.wait_seconds_total / started, 3) if started else 0.0
+        }
+
+# Глобальная очередь задач обработки
+job_queue = JobQueue(
+    background_processor.process_task,
+    max_size=Config.QUEUE_MAX_SIZE,
+    workers=Config.QUEUE_WORKERS
+)
@@ -0,0 +1,355 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque, OrderedDict
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, Any, Optional, Deque, NamedTuple
+
+from .config import Config
+from .db import connect
+
+class TokenBucket:
+    """Token bucket в памяти процесса"""
+    
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+    
+    def _take(self) -> float:
+        """Забирает токен; возвращает время ожидания, если токенов нет"""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+    
+    async def acquire(self):
+        """Ожидает появления токена"""
+        if self.rate <= 0:
+            return
+        while (wait := self._take()) > 0:
+            await asyncio.sleep(wait)
+
+class SQLiteTokenBucket(TokenBucket):
+    """Token bucket в общей SQLite базе: скорость делится между всеми воркерами"""
+    
+    def __init__(self, name: str, rate: float, burst: int, db_path: Path):
+        super().__init__(rate, burst)
+        self.name = name
+        self._lock = threading.Lock()
+        self._conn = connect(db_path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS token_buckets ("
+            "name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+    
+    def _take_shared(self) -> float:
+        with self._lock:
+            now = time.time()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT tokens, updated_at FROM token_buckets WHERE name = ?", (self.name,)
+                ).fetchone()
+                tokens = self.burst if row is None else min(
+                    self.burst, row["tokens"] + max(0.0, now - row["updated_at"]) * self.rate
+                )
+                
+                wait = 0.0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    wait = (1 - tokens) / self.rate
+                
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO token_buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                    (self.name, tokens, now)
+                )
+                self._conn.execute("COMMIT")
+                return wait
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+    
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        while (wait := await asyncio.to_thread(self._take_shared)) > 0:
+            await asyncio.sleep(wait)
+
+class UpstreamLimiter:
+    """Ограничитель обращений к внешнему API: параллелизм + скорость, справедливо между задачами"""
+    
+    def __init__(self, name: str, concurrency: int, bucket: TokenBucket):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.bucket = bucket
+        self._active = 0
+        # Очереди ожидающих по владельцам (задачам), обслуживаются по кругу
+        self._waiters: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._acquired_total = 0
+        self._wait_seconds_total = 0.0
+        self._max_queue_depth = 0
+    
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._waiters.values())
+    
+    @asynccontextmanager
+    async def slot(self, owner: str = "default"):
+        """Занимает слот обращения к API на время блока"""
+        started = time.monotonic()
+        await self._acquire_slot(owner)
+        try:
+            await self.bucket.acquire()
+            self._acquired_total += 1
+            self._wait_seconds_total += time.monotonic() - started
+            yield
+        finally:
+            self._release()
+    
+    async def _acquire_slot(self, owner: str):
+        if self._active < self.concurrency and not self._waiters:
+            self._active += 1
+            return
+        
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(owner, deque()).append(future)
+        self._max_queue_depth = max(self._max_queue_depth, self.queue_depth)
+        
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слот уже выдан, но ожидающий отменен: возвращаем слот
+                self._release()
+            else:
+                self._remove_waiter(owner, future)
+            raise
+    
+    def _remove_waiter(self, owner: str, future: asyncio.Future):
+        queue = self._waiters.get(owner)
+        if queue and future in queue:
+            queue.remove(future)
+            if not queue:
+                del self._waiters[owner]
+    
+    def _release(self):
+        self._active -= 1
+        self._wake_next()
+    
+    def _wake_next(self):
+        """Выдает освободившиеся слоты владельцам по кругу"""
+        while self._active < self.concurrency and self._waiters:
+            owner, queue = self._waiters.popitem(last=False)
+            future = queue.popleft()
+            if queue:
+                self._waiters[owner] = queue
+            if future.done():
+                continue
+            self._active += 1
+            future.set_result(None)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Текущее состояние лимитера"""
+        return {
+            "name": self.name,
+            "concurrency": self.concurrency,
+            "rate": self.bucket.rate,
+            "active": self._active,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self._max_queue_depth,
+            "waiting_owners": len(self._waiters),
+            "acquired_total": self._acquired_total,
+            "wait_seconds_total": round(self._wait_seconds_total, 3)
+        }
+
+class UpstreamLimits:
+    """Общие для процесса лимитеры внешних API"""
+    
+    def __init__(self):
+        self._limiters: Dict[str, UpstreamLimiter] = {}
+    
+    def get(self, name: str) -> UpstreamLimiter:
+        """Возвращает лимитер внешнего API, создавая его по конфигурации"""
+        if name not in self._limiters:
+            settings = Config.UPSTREAM_LIMITS[name]
+            if Config.LIMITER_BACKEND == "sqlite":
+                bucket = SQLiteTokenBucket(name, settings["rate"], settings["burst"], Config.LIMITER_DB_PATH)
+            else:
+                bucket = TokenBucket(settings["rate"], settings["burst"])
+            self._limiters[name] = UpstreamLimiter(name, settings["concurrency"], bucket)
+        return self._limiters[name]
+    
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Состояние всех лимитеров"""
+        return {name: self.get(name).stats() for name in Config.UPSTREAM_LIMITS}
+
+class RateLimitResult(NamedTuple):
+    """Решение лимитера пользователя"""
+    allowed: bool
+    limit: int
+    remaining: int
+    # Через сколько секунд лимит полностью восстановится
+    reset_after: float
+    # Через сколько секунд можно повторить отклоненный запрос
+    retry_after: float
+    
+    def headers(self, prefix: str = "X-RateLimit") -> Dict[str, str]:
+        headers = {
+            f"{prefix}-Limit": str(self.limit),
+            f"{prefix}-Remaining": str(self.remaining),
+            f"{prefix}-Reset": str(math.ceil(self.reset_after))
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(math.ceil(self.retry_after))
+        return headers
+
+class GCRALimiter:
+    """GCRA (generic cell rate algorithm): одно время TAT на ключ, O(1) на запрос"""
+    
+    def __init__(self):
+        self._tat: Dict[str, float] = {}
+    
+    @staticmethod
+    def decide(tat: Optional[float], now: float, limit: int, period: float, cost: int):
+        """Возвращает новое TAT (None, если запрос отклонен) и решение"""
+        interval = period / limit
+        tat = max(tat or now, now)
+        new_tat = tat + cost * interval
+        # Допуск на всплеск: за период можно израсходовать весь лимит сразу
+        if new_tat - now > period:
+            return None, RateLimitResult(
+                allowed=False,
+                limit=limit,
+                remaining=max(0, int((period - (tat - now)) / interval)),
+                reset_after=tat - now,
+                retry_after=new_tat - now - period
+            )
+        return new_tat, RateLimitResult(
+            allowed=True,
+            limit=limit,
+            remaining=max(0, int((period - (new_tat - now)) / interval)),
+            reset_after=new_tat - now,
+            retry_after=0.0
+        )
+    
+    @staticmethod
+    def refunded(tat: Optional[float], now: float, limit: int, period: float, cost: int) -> Optional[float]:
+        """TAT после возврата cost единиц (не раньше текущего времени); None - возвращать нечего"""
+        if tat is None or tat <= now:
+            return None
+        return max(now, tat - cost * period / limit)
+    
+    def _check(self, key: str, limit: int, period: float, cost: int) -> RateLimitResult:
+        new_tat, result = self.decide(self._tat.get(key), time.time(), limit, period, cost)
+        if new_tat is not None:
+            self._tat[key] = new_tat
+        return result
+    
+    def _refund(self, key: str, limit: int, period: float, cost: int):
+        new_tat = self.refunded(self._tat.get(key), time.time(), limit, period, cost)
+        if new_tat is not None:
+            self._tat[key] = new_tat
+    
+    async def check(self, key: str, limit: int, period: float, cost: int = 1) -> RateLimitResult:
+        return self._check(key, limit, period, cost)
+    
+    async def refund(self, key: str, limit: int, period: float, cost: int = 1):
+        """Возвращает единицы, списанные запросом, который в итоге не был выполнен"""
+        self._refund(key, limit, period, cost)
+
+class SQLiteGCRALimiter(GCRALimiter):
+    """GCRA в общей SQLite базе: лимиты пользователя действуют во всех воркерах"""
+    
+    def __init__(self, db_path: Path):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._conn = connect(db_path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, tat REAL NOT NULL)")
+    
+    def _check(self, key: str, limit: int, period: float, cost: int) -> RateLimitResult:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT tat FROM rate_limits WHERE key = ?", (key,)).fetchone()
+                new_tat, result = self.decide(row["tat"] if row else None, time.time(), limit, period, cost)
+                if new_tat is not None:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO rate_limits (key, tat) VALUES (?, ?)", (key, new_tat)
+                    )
+                self._conn.execute("COMMIT")
+                return result
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+    
+    def _refund(self, key: str, limit: int, period: float, cost: int):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT tat FROM rate_limits WHERE key = ?", (key,)).fetchone()
+                new_tat = self.refunded(row["tat"] if row else None, time.time(), limit, period, cost)
+                if new_tat is not None:
+                    self._conn.execute("UPDATE rate_limits SET tat = ? WHERE key = ?", (new_tat, key))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+    
+    async def check(self, key: str, limit: int, period: float, cost: int = 1) -> RateLimitResult:
+        return await asyncio.to_thread(self._check, key, limit, period, cost)
+    
+    async def refund(self, key: str, limit: int, period: float, cost: int = 1):
+        await asyncio.to_thread(self._refund, key, limit, period, cost)
+
+class UserRateLimiter:
+    """Лимиты пользователя: rate_limit запросов и rate_limit * images_per_request изображений за период"""
+    
+    def __init__(self, limiter: GCRALimiter, period: float, images_per_request: int):
+        self.limiter = limiter
+        self.period = period
+        self.images_per_request = images_per_request
+    
+    async def check_requests(self, user: Dict[str, Any]) -> Optional[RateLimitResult]:
+        """None - для пользователя лимит не задан"""
+        limit = user.get("rate_limit") or 0
+        if limit <= 0:
+            return None
+        return await self.limiter.check(f"requests:{user['username']}", limit, self.period)
+    
+    def image_limit(self, user: Dict[str, Any]) -> int:
+        return (user.get("rate_limit") or 0) * self.images_per_request
+    
+    async def check_images(self, user: Dict[str, Any], count: int) -> Optional[RateLimitResult]:
+        limit = self.image_limit(user)
+        if limit <= 0:
+            return None
+        return await self.limiter.check(f"images:{user['username']}", limit, self.period, count)
+    
+    async def refund_images(self, user: Dict[str, Any], count: int):
+        """Возвращает изображения запроса, отклоненного после check_images"""
+        limit = self.image_limit(user)
+        if limit > 0:
+            await self.limiter.refund(f"images:{user['username']}", limit, self.period, count)
+
+def create_user_rate_limiter() -> UserRateLimiter:
+    """Создает лимитер пользователей по конфигурации"""
+    if Config.USER_RATE_LIMIT_BACKEND == "sqlite":
+        limiter = SQLiteGCRALimiter(Config.LIMITER_DB_PATH)
+    else:
+        limiter = GCRALimiter()
+    return UserRateLimiter(limiter, Config.USER_RATE_LIMIT_PERIOD, Config.USER_IMAGES_PER_REQUEST)
+
+# Глобальные лимитеры внешних API
+upstream_limits = UpstreamLimits()
+
+# Глобальный лимитер пользователей
+user_rate_limiter = create_user_rate_limiter()
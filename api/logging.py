@@ -1,51 +1,199 @@
+import asyncio
+import atexit
 import os
+import threading
+import time
+from collections import deque
 from datetime import datetime
+from typing import Any, Deque, Dict, Optional, Tuple
 from log import Log
 
+from .config import Config
+
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40, "critical": 50}
+
+# Запись: (токен, метод Log, позиционные аргументы, именованные аргументы)
+LogRecord = Tuple[str, str, tuple, Dict[str, Any]]
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+class LogDispatcher:
+    """Отправка записей в сервис логов из фонового потока: кольцевой буфер и пакетный сброс"""
+    
+    def __init__(self, capacity: int, batch_size: int, flush_interval: float, policy: str, block_timeout: float):
+        self.capacity = max(1, capacity)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        # drop - при переполнении вытесняется самая старая запись, block - вызывающий ждет места
+        # (только вне event loop: ожидание в потоке loop остановило бы все запросы)
+        self.policy = policy
+        self.block_timeout = block_timeout
+        
+        self._buffer: Deque[LogRecord] = deque()
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._in_flight = 0
+        self._closed = False
+        self._atexit_registered = False
+        # Один клиент Log на токен на весь процесс
+        self._transports: Dict[str, Log] = {}
+        
+        self.submitted = 0
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+    
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._closed = False
+            self._thread = threading.Thread(target=self._run, name="log-dispatcher", daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.close)
+                self._atexit_registered = True
+    
+    def submit(self, token: str, method: str, args: tuple = (), kwargs: Optional[Dict[str, Any]] = None):
+        """Ставит запись в буфер, не дожидаясь отправки"""
+        with self._condition:
+            self._ensure_thread()
+            if len(self._buffer) >= self.capacity and self.policy == "block" and not _on_event_loop():
+                self._condition.wait_for(lambda: len(self._buffer) < self.capacity, timeout=self.block_timeout)
+            if len(self._buffer) >= self.capacity:
+                self._buffer.popleft()
+                self.dropped += 1
+            self._buffer.append((token, method, args, kwargs or {}))
+            self.submitted += 1
+            self._condition.notify_all()
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._buffer or self._closed, timeout=self.flush_interval)
+                if not self._buffer and self._closed:
+                    return
+                batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                self._in_flight = len(batch)
+                # Освободилось место: будим ожидающих при политике block
+                self._condition.notify_all()
+            
+            for record in batch:
+                self._send(record)
+            
+            with self._condition:
+                self._in_flight = 0
+                self._condition.notify_all()
+    
+    def _send(self, record: LogRecord):
+        token, method, args, kwargs = record
+        try:
+            transport = self._transports.get(token)
+            if transport is None:
+                transport = self._transports[token] = Log(token=token, auto_host=True)
+            if args and isinstance(args[0], str) and len(args) > 1 and method in LEVELS:
+                # Форматирование отложено до отправки: на event loop только постановка в буфер
+                args = (args[0] % args[1:],)
+            getattr(transport, method)(*args, **kwargs)
+            self.sent += 1
+        except Exception:
+            # Сбой сервиса логов не должен ронять обработку
+            self.failed += 1
+    
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Ждет отправки всех накопленных записей"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            if self._thread is None:
+                return not self._buffer
+            self._condition.notify_all()
+            return self._condition.wait_for(
+                lambda: not self._buffer and not self._in_flight,
+                timeout=max(0.0, deadline - time.monotonic())
+            )
+    
+    def close(self, timeout: Optional[float] = None):
+        """Отправляет оставшиеся записи и останавливает поток"""
+        timeout = Config.LOG_FLUSH_TIMEOUT if timeout is None else timeout
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "policy": self.policy,
+            "capacity": self.capacity,
+            "buffered": len(self._buffer),
+            "submitted": self.submitted,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "failed": self.failed
+        }
+
+# Общий для процесса отправитель логов
+log_dispatcher = LogDispatcher(
+    capacity=Config.LOG_BUFFER_SIZE,
+    batch_size=Config.LOG_BATCH_SIZE,
+    flush_interval=Config.LOG_FLUSH_INTERVAL,
+    policy=Config.LOG_OVERFLOW_POLICY,
+    block_timeout=Config.LOG_BLOCK_TIMEOUT
+)
+
 class CustomLogger:
     """Кастомный логгер для API с поддержкой двух типов обработки"""
     
     def __init__(self, processing_type: str):
         self.processing_type = processing_type
         self.period_from = datetime.now()
+        self.level = LEVELS.get(Config.LOG_LEVEL.lower(), LEVELS["info"])
         
         if processing_type == "white":
             token = os.getenv("PORADOCK_LOG_TOKEN_WHITE")
-        else: 
+        else:
             token = os.getenv("PORADOCK_LOG_TOKEN_INTERIOR")
-            
+        
         if not token:
             raise ValueError(f"Token for {processing_type} processing not found")
-            
-        self.logger = Log(token=token, auto_host=True)
+        
+        self.token = token
+    
+    def _log(self, level: str, msg: str, args: tuple):
+        # Уровень проверяется до постановки в буфер; аргументы args подставляются в msg (%) при отправке
+        if LEVELS[level] >= self.level:
+            log_dispatcher.submit(self.token, level, (msg, *args))
     
-    def info(self, msg: str):
-        self.logger.info(msg)
+    def info(self, msg: str, *args):
+        self._log("info", msg, args)
     
-    def debug(self, msg: str):
-        self.logger.debug(msg)
+    def debug(self, msg: str, *args):
+        self._log("debug", msg, args)
     
-    def warning(self, msg: str):
-        self.logger.warning(msg)
+    def warning(self, msg: str, *args):
+        self._log("warning", msg, args)
     
-    def error(self, msg: str):
-        self.logger.error(msg)
+    def error(self, msg: str, *args):
+        self._log("error", msg, args)
     
-    def critical(self, msg: str):
-        self.logger.critical(msg)
+    def critical(self, msg: str, *args):
+        self._log("critical", msg, args)
     
     def finish_success(self, **kwargs):
         period_to = datetime.now()
-        self.logger.finish_success(self.period_from, period_to, **kwargs)
+        log_dispatcher.submit(self.token, "finish_success", (self.period_from, period_to), kwargs)
     
     def finish_warning(self, **kwargs):
         period_to = datetime.now()
-        self.logger.finish_warning(self.period_from, period_to, **kwargs)
+        log_dispatcher.submit(self.token, "finish_warning", (self.period_from, period_to), kwargs)
     
     def finish_error(self, **kwargs):
         period_to = datetime.now()
-        self.logger.finish_error(self.period_from, period_to, **kwargs)
+        log_dispatcher.submit(self.token, "finish_error", (self.period_from, period_to), kwargs)
     
     def finish_log(self, status, **kwargs):
         period_to = datetime.now()
-        self.logger.finish_log(self.period_from, period_to, status=status, **kwargs)
\ No newline at end of file
+        log_dispatcher.submit(self.token, "finish_log", (self.period_from, period_to), {"status": status, **kwargs})
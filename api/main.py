@@ -1,16 +1,34 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Depends
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Header, Request
 from fastapi.responses import Response, StreamingResponse
-from typing import List
+from typing import List, Optional
 import asyncio
 from datetime import datetime
 import io
+import mimetypes
+import secrets
+import time
 
 from .task_manager import task_manager
-from .background_processor import background_processor
+from .job_queue import job_queue, QueueFullError
 from .processors.async_white_processor import AsyncWhiteProcessor
 from .processors.async_interior_processor import AsyncInteriorProcessor
-from .models.schemas import ProcessingResponse, ImageResponse, TaskStatusResponse, TaskStatus
-from .auth import auth_manager, verify_api_key, verify_admin
+from .models.schemas import ProcessingResponse, ImageResponse, TaskStatusResponse, TaskStatus, TaskFilesResponse, TaskFileInfo
+from .auth import auth_manager, verify_api_key, verify_admin, enforce_rate_limit
+from .config import Config
+from .clients import client_registry
+from .limiter import upstream_limits, user_rate_limiter
+from .resilience import upstream_callers
+from .cache import result_cache
+from .result_store import result_store
+from .cpu_executor import cpu_executor
+from .ingest import upload_spool, UploadTooLargeError
+from interior.classification_cache import classification_cache
+from . import metrics
+from .logging import log_dispatcher
+from .events import FINAL_STATUSES, task_events, task_snapshot, format_sse
+from .webhooks import webhook_notifier, validate_webhook_url, WebhookURLError
+from .task_outputs import task_outputs, archive_files, read_archive_file, EMPTY_ZIP
+from .streaming import file_range_response, open_file_response, range_response
 from .models.auth_schemas import UserCreate, UserResponse, APIKeyResponse, UserUpdate
 
 app = FastAPI(
@@ -19,16 +37,122 @@ app = FastAPI(
     version="2.3.0"
 )
 
+@app.middleware("http")
+async def record_http_metrics(request: Request, call_next):
+    """Счетчик и задержка HTTP-запросов по шаблону маршрута"""
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    metrics.http_requests_total.labels(request.method, path, str(response.status_code)).inc()
+    metrics.http_request_seconds.labels(request.method, path).observe(time.perf_counter() - started)
+    return response
+
+def collect_runtime_metrics():
+    """Обновляет gauge-метрики по текущему состоянию компонентов"""
+    queue = job_queue.stats()
+    metrics.queue_depth.set(queue["depth"])
+    metrics.active_tasks.set(queue["active"])
+    
+    for name, limiter in upstream_limits.stats().items():
+        metrics.upstream_active.labels(name).set(limiter["active"])
+        metrics.upstream_waiters.labels(name).set(limiter["queue_depth"])
+    
+    states = {"closed": 0, "half_open": 1, "open": 2}
+    for circuit, breaker in upstream_callers.circuit_stats().items():
+        metrics.circuit_state.labels(circuit).set(states[breaker["state"]])
+    
+    cache = result_cache.stats()
+    metrics.cache_hit_ratio.labels("result").set(cache["hit_rate"])
+    metrics.cache_hit_ratio.labels("classification").set(classification_cache.stats()["hit_rate"])
+    metrics.memory_bytes.labels("result_cache").set(cache["memory_bytes"])
+    
+    metrics.task_event_subscribers.set(task_events.stats()["subscribers"])
+    
+    logs = log_dispatcher.stats()
+    metrics.log_records_buffered.set(logs["buffered"])
+    metrics.log_records_dropped.set(logs["dropped"])
+    if Config.RESULT_STORE_BACKEND == "memory":
+        metrics.memory_bytes.labels("result_store").set(result_store.stats()["memory_bytes"])
+
+metrics.metrics_registry.add_collector(collect_runtime_metrics)
+
 @app.on_event("startup")
 async def startup_event():
-    """Запускаем периодическую очистку старых задач"""
+    """Запускаем периодическую очистку старых задач, очередь обработки и общие HTTP-сессии"""
+    await client_registry.startup()
+    await task_manager.heartbeat()
+    await job_queue.start()
+    await recover_tasks()
     asyncio.create_task(periodic_cleanup())
+    asyncio.create_task(periodic_heartbeat())
+    asyncio.create_task(periodic_auth_flush())
+    asyncio.create_task(periodic_auth_refresh())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Дожидаемся завершения начатых задач и закрываем общие HTTP-сессии"""
+    # Ожидающие задачи остаются PENDING: их подхватит следующий запуск или другой воркер
+    for task_id in await job_queue.drain(Config.QUEUE_DRAIN_TIMEOUT):
+        await task_manager.set_task_error(task_id, "Task interrupted by server shutdown")
+        task_manager.release_inputs(task_id)
+    await task_manager.retire()
+    # Уведомления о задачах, прерванных остановкой, тоже отправляем
+    await webhook_notifier.close()
+    await client_registry.shutdown()
+    cpu_executor.shutdown()
+    await auth_manager.flush_last_used()
+    log_dispatcher.close()
 
 async def periodic_cleanup():
     """Периодическая очистка старых задач"""
     while True:
         await asyncio.sleep(3600)
-        task_manager.cleanup_old_tasks()
+        await task_manager.cleanup_old_tasks()
+        await recover_tasks()
+
+async def recover_tasks():
+    """Подхватывает задачи завершившихся воркеров: ожидавшие очереди ставит в очередь заново"""
+    for task_id in await task_manager.recover_interrupted_tasks():
+        try:
+            # Задачи уже были приняты, поэтому лимит очереди к ним не применяем; приоритет не сохраняется
+            await job_queue.submit(task_id, force=True)
+        except QueueFullError:
+            await task_manager.set_task_error(task_id, "Task interrupted by server shutdown")
+            task_manager.release_inputs(task_id)
+
+async def periodic_heartbeat():
+    """Периодически отмечает воркер живым, чтобы другие не сочли его задачи прерванными"""
+    while True:
+        await asyncio.sleep(Config.WORKER_HEARTBEAT_INTERVAL)
+        try:
+            await task_manager.heartbeat()
+        except Exception:
+            # База занята дольше busy_timeout: отметимся в следующий раз
+            pass
+
+async def periodic_auth_flush():
+    """Периодически сохраняет время последнего использования API ключей"""
+    while True:
+        await asyncio.sleep(Config.AUTH_FLUSH_INTERVAL)
+        await auth_manager.flush_last_used()
+
+async def periodic_auth_refresh():
+    """Периодически перечитывает пользователей, измененных другими воркерами"""
+    while True:
+        await asyncio.sleep(Config.AUTH_RELOAD_INTERVAL)
+        try:
+            await auth_manager.refresh_index()
+        except Exception:
+            # Хранилище недоступно: проверка ключей идет по прежнему индексу
+            pass
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(authorization: Optional[str] = Header(None)):
+    """Метрики процесса в текстовом формате Prometheus"""
+    if Config.METRICS_TOKEN and not secrets.compare_digest(authorization or "", f"Bearer {Config.METRICS_TOKEN}"):
+        raise HTTPException(401, "Invalid metrics token")
+    return Response(metrics.metrics_registry.render(), media_type=metrics.MetricsRegistry.CONTENT_TYPE)
 
 # ==================== AUTH ENDPOINTS ====================
 
@@ -70,7 +194,7 @@ async def process_single_image(
             media_type="image/jpeg",
             headers={"Content-Disposition": f"attachment; filename={filename}"}
         )
-        
+    
     except Exception as e:
         raise HTTPException(500, f"Processing failed: {str(e)}")
 
@@ -103,7 +227,7 @@ async def process_batch(
                 "Content-Disposition": "attachment; filename=processed_images.zip",
             }
         )
-        
+    
     except Exception as e:
         raise HTTPException(500, f"Processing failed: {str(e)}")
 '''
@@ -111,32 +235,104 @@ async def process_batch(
           response_model=ProcessingResponse,
           tags=["processing"])
 async def process_parallel(
-    background_tasks: BackgroundTasks,
+    response: Response,
     white_bg: bool = True,
+    concurrency: Optional[int] = None,
+    callback_url: Optional[str] = None,
     files: List[UploadFile] = File(...),
-    user: dict = Depends(verify_api_key)
+    user: dict = Depends(enforce_rate_limit)
 ):
     """
-    Запуск параллельной обработки с возвратом идентификатора задачи
+    Запуск параллельной обработки с возвратом идентификатора задачи и позиции в очереди
+    
+    По завершении задачи на callback_url (если задан) отправляется POST с ее итоговым статусом
     """
     if not files:
         raise HTTPException(400, "No files provided")
     
+    if callback_url is not None:
+        try:
+            await validate_webhook_url(callback_url)
+        except WebhookURLError as e:
+            raise HTTPException(400, str(e))
+    
+    if job_queue.is_full():
+        raise HTTPException(
+            429,
+            f"Processing queue is full ({job_queue.depth} tasks waiting)",
+            headers={"Retry-After": str(Config.QUEUE_RETRY_AFTER)}
+        )
+    
+    # Лимит пользователя по числу изображений
+    image_limit = user_rate_limiter.image_limit(user)
+    if image_limit > 0 and len(files) > image_limit:
+        raise HTTPException(413, f"Too many files: at most {image_limit} images per {Config.USER_RATE_LIMIT_PERIOD:.0f}s")
+    
+    # Сохраняем загрузки в каталог задачи: исходные файлы FastAPI закроет после ответа.
+    # Проверка размеров идет до списания изображений: отклоненный запрос лимит не расходует
+    task_id = task_manager.new_task_id()
+    try:
+        spooled = await upload_spool.spool(task_id, files)
+    except UploadTooLargeError as e:
+        raise HTTPException(413, str(e))
+    
+    images = await user_rate_limiter.check_images(user, len(files))
+    if images is not None:
+        if not images.allowed:
+            upload_spool.remove(task_id)
+            raise HTTPException(429, "Image rate limit exceeded", headers=images.headers("X-RateLimit-Images"))
+        response.headers.update(images.headers("X-RateLimit-Images"))
+    
     # Создаем задачу
-    task_id = task_manager.create_task(white_bg, files)
+    task_id = await task_manager.create_task(
+        white_bg, spooled, Config.resolve_concurrency(concurrency), username=user.get("username"), task_id=task_id,
+        webhook_url=callback_url
+    )
     
-    # Запускаем фоновую обработку
-    background_tasks.add_task(background_processor.process_task, task_id)
+    # Ставим задачу в очередь обработки
+    try:
+        queue_position = await job_queue.submit(task_id, priority=user.get("priority", 0))
+    except QueueFullError as e:
+        await task_manager.set_task_error(task_id, str(e))
+        task_manager.release_inputs(task_id)
+        # Задача не выполнится: списанные изображения возвращаем пользователю
+        await user_rate_limiter.refund_images(user, len(files))
+        raise HTTPException(429, str(e), headers={"Retry-After": str(e.retry_after)})
     
     return ProcessingResponse(
         success=True,
-        message="Parallel processing started",
+        message="Parallel processing queued",
         file_count=len(files),
-        task_id=task_id
+        task_id=task_id,
+        queue_position=queue_position
     )
 
 # ==================== TASKS ENDPOINTS ====================
 
+@app.get("/api/v1/tasks",
+         response_model=List[TaskStatusResponse],
+         tags=["tasks"])
+async def list_tasks(
+    status: Optional[TaskStatus] = None,
+    limit: int = 100,
+    user: dict = Depends(verify_api_key)
+):
+    """Список задач текущего пользователя, новые первыми"""
+    tasks = await task_manager.list_tasks(username=user.get("username"), status=status, limit=min(limit, 1000))
+    return [
+        TaskStatusResponse(
+            task_id=task["task_id"],
+            status=task["status"],
+            progress=task["progress"],
+            processed_files=task["processed_files"],
+            total_files=task["total_files"],
+            start_time=task["start_time"],
+            end_time=task["end_time"],
+            error=task["error"]
+        )
+        for task in tasks
+    ]
+
 @app.get("/api/v1/tasks/{task_id}/status", 
          response_model=TaskStatusResponse,
          tags=["tasks"])
@@ -145,7 +341,7 @@ async def get_task_status(
     user: dict = Depends(verify_api_key)
 ):
     """Получение статуса и прогресса выполнения задачи"""
-    task = task_manager.get_task(task_id)
+    task = await task_manager.get_task(task_id)
     if not task:
         raise HTTPException(404, "Task not found")
     
@@ -157,17 +353,78 @@ async def get_task_status(
         total_files=task["total_files"],
         start_time=task["start_time"],
         end_time=task["end_time"],
+        queue_position=job_queue.position(task_id),
         error=task["error"]
     )
 
+@app.get("/api/v1/tasks/{task_id}/events",
+         tags=["tasks"])
+async def stream_task_events(
+    task_id: str,
+    user: dict = Depends(verify_api_key)
+):
+    """
+    Поток событий задачи (Server-Sent Events) вместо опроса /status
+    
+    События: status - состояние задачи (как в /status), file - обработан очередной файл,
+    done - итоговый статус, после него поток закрывается
+    """
+    if not await task_manager.get_task(task_id):
+        raise HTTPException(404, "Task not found")
+    
+    return StreamingResponse(
+        _task_event_stream(task_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _task_event_stream(task_id: str):
+    # Подписка до чтения состояния: обновления между ними не теряются
+    queue = task_events.subscribe(task_id)
+    try:
+        last = None
+        snapshot = None
+        while True:
+            if snapshot is None:
+                # Первое состояние и перечитывание по таймауту: так видны и задачи других воркеров
+                task = await task_manager.get_task(task_id)
+                if task is None:
+                    yield format_sse("error", {"task_id": task_id, "error": "Task not found"})
+                    return
+                snapshot = task_snapshot(task)
+            snapshot["queue_position"] = job_queue.position(task_id)
+            
+            if snapshot["status"] in FINAL_STATUSES:
+                yield format_sse("done", snapshot)
+                return
+            if snapshot != last:
+                yield format_sse("status", snapshot)
+                last = snapshot
+            
+            try:
+                event, data = await asyncio.wait_for(queue.get(), timeout=Config.TASK_EVENTS_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                snapshot = None
+                continue
+            
+            if event == "status":
+                snapshot = dict(data)
+            else:
+                yield format_sse(event, data)
+                snapshot = dict(last)
+    finally:
+        task_events.unsubscribe(task_id, queue)
+
 @app.get("/api/v1/tasks/{task_id}/download",
          tags=["tasks"])
 async def download_task_result(
     task_id: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
     user: dict = Depends(verify_api_key)
 ):
-    """Скачивание результатов выполненной задачи"""
-    task = task_manager.get_task(task_id)
+    """Скачивание результатов выполненной задачи (поддерживается HTTP Range)"""
+    task = await task_manager.get_task(task_id)
     if not task:
         raise HTTPException(404, "Task not found")
     
@@ -177,17 +434,118 @@ async def download_task_result(
     if not task["result"]:
         raise HTTPException(500, "Task result not available")
     
-    # Возвращаем ZIP архив
-    zip_buffer: io.BytesIO = task["result"]
+    if not result_store.exists(task["result"]):
+        raise HTTPException(410, "Task result expired")
     
-    return Response(
-        content=zip_buffer.getvalue(),
-        media_type="application/zip",
-        headers={
-            "Content-Disposition": f"attachment; filename=processed_{task_id}.zip",
-        }
+    # Отдаем ZIP архив потоково, без копирования в память
+    return result_store.response(
+        task["result"],
+        filename=f"processed_{task_id}.zip",
+        range_header=range_header
     )
 
+def _final_archive(task: dict) -> Optional[str]:
+    """Ключ итогового архива завершенной задачи: после его сохранения файлы по одному удаляются"""
+    if task["status"] == TaskStatus.COMPLETED and task["result"] and result_store.exists(task["result"]):
+        return task["result"]
+    return None
+
+@app.get("/api/v1/tasks/{task_id}/files",
+         response_model=TaskFilesResponse,
+         tags=["tasks"])
+async def list_task_files(
+    task_id: str,
+    user: dict = Depends(verify_api_key)
+):
+    """Список уже обработанных файлов задачи (доступен до ее завершения)"""
+    task = await task_manager.get_task(task_id)
+    if not task:
+        raise HTTPException(404, "Task not found")
+    
+    archive_key = _final_archive(task)
+    if archive_key is not None:
+        files = await asyncio.to_thread(lambda: archive_files(result_store.open(archive_key)))
+    else:
+        files = await asyncio.to_thread(task_outputs.list, task_id)
+    return TaskFilesResponse(
+        task_id=task_id,
+        status=task["status"],
+        processed_files=task["processed_files"],
+        total_files=task["total_files"],
+        files=[
+            TaskFileInfo(name=item["name"], size=item["size"], completed_at=datetime.fromtimestamp(item["completed_at"]))
+            for item in files
+        ]
+    )
+
+@app.get("/api/v1/tasks/{task_id}/files/{filename}",
+         tags=["tasks"])
+async def download_task_file(
+    task_id: str,
+    filename: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    user: dict = Depends(verify_api_key)
+):
+    """Скачивание одного обработанного файла задачи (поддерживается HTTP Range)"""
+    if not await task_manager.get_task(task_id):
+        raise HTTPException(404, "Task not found")
+    
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    path = task_outputs.path(task_id, filename)
+    if path is not None:
+        try:
+            return file_range_response(path, filename, media_type, range_header)
+        except FileNotFoundError:
+            # Задача завершилась между проверкой и чтением
+            pass
+    
+    # Задача могла завершиться после первого чтения статуса: тогда файл уже только в архиве
+    task = await task_manager.get_task(task_id)
+    archive_key = _final_archive(task) if task else None
+    data = None
+    if archive_key is not None:
+        data = await asyncio.to_thread(lambda: read_archive_file(result_store.open(archive_key), filename))
+    if data is None:
+        raise HTTPException(404, "File not found")
+    return range_response(data, filename, media_type, range_header)
+
+@app.get("/api/v1/tasks/{task_id}/download/partial",
+         tags=["tasks"])
+async def download_partial_result(
+    task_id: str,
+    user: dict = Depends(verify_api_key)
+):
+    """Скачивание ZIP с файлами, обработанными на данный момент (в том числе до завершения задачи)"""
+    task = await task_manager.get_task(task_id)
+    if not task:
+        raise HTTPException(404, "Task not found")
+    
+    response = None
+    if task["status"] != TaskStatus.COMPLETED:
+        try:
+            # Пока число готовых файлов не изменилось, отдается уже собранный архив
+            archive, count = await task_outputs.partial_zip(task_id)
+            response = open_file_response(archive, f"processed_{task_id}_partial.zip", "application/zip")
+        except FileNotFoundError:
+            # Готовых файлов еще нет, либо задача успела завершиться и они уже удалены
+            task = await task_manager.get_task(task_id)
+            if not task:
+                raise HTTPException(404, "Task not found")
+            if task["status"] != TaskStatus.COMPLETED:
+                response, count = range_response(EMPTY_ZIP, f"processed_{task_id}_partial.zip", "application/zip"), 0
+    
+    if response is None:
+        archive_key = _final_archive(task)
+        if archive_key is None:
+            raise HTTPException(410, "Task result expired")
+        count = len(await asyncio.to_thread(lambda: archive_files(result_store.open(archive_key))))
+        response = result_store.response(archive_key, filename=f"processed_{task_id}.zip")
+    
+    response.headers["X-Files-Count"] = str(count)
+    response.headers["X-Total-Files"] = str(task["total_files"])
+    response.headers["X-Task-Status"] = task["status"].value
+    return response
+
 # ==================== ADMIN ENDPOINTS ====================
 
 @app.post("/api/v1/admin/users", 
@@ -199,10 +557,11 @@ async def create_user(
 ):
     """Создание нового пользователя системы"""
     try:
-        api_key = auth_manager.create_user(
+        api_key = await auth_manager.create_user(
             username=user_data.username,
             is_admin=user_data.is_admin,
-            rate_limit=user_data.rate_limit
+            rate_limit=user_data.rate_limit,
+            priority=user_data.priority
         )
         
         return APIKeyResponse(
@@ -210,7 +569,7 @@ async def create_user(
             api_key=api_key,
             message="User created successfully"
         )
-        
+    
     except ValueError as e:
         raise HTTPException(400, str(e))
     except Exception as e:
@@ -222,7 +581,7 @@ async def create_user(
 async def list_users(admin: dict = Depends(verify_admin)):
     """Получение списка всех пользователей системы"""
     try:
-        users = auth_manager.get_users(admin)
+        users = await auth_manager.get_users(admin)
         return users
     except PermissionError as e:
         raise HTTPException(403, str(e))
@@ -238,12 +597,12 @@ async def update_user(
 ):
     """Обновление данных пользователя"""
     try:
-        success = auth_manager.update_user(username, updates.dict(exclude_unset=True), admin)
+        success = await auth_manager.update_user(username, updates.dict(exclude_unset=True), admin)
         if not success:
             raise HTTPException(404, f"User {username} not found")
         
         return {"message": f"User {username} updated successfully"}
-        
+    
     except PermissionError as e:
         raise HTTPException(403, str(e))
     except Exception as e:
@@ -257,17 +616,70 @@ async def delete_user(
 ):
     """Удаление пользователя из системы"""
     try:
-        success = auth_manager.delete_user(username, admin)
+        success = await auth_manager.delete_user(username, admin)
         if not success:
             raise HTTPException(404, f"User {username} not found")
         
         return {"message": f"User {username} deleted successfully"}
-        
+    
     except PermissionError as e:
         raise HTTPException(403, str(e))
     except Exception as e:
         raise HTTPException(500, f"Failed to delete user: {str(e)}")
 
+@app.get("/api/v1/admin/limits",
+         tags=["admin"])
+async def get_upstream_limits(admin: dict = Depends(verify_admin)):
+    """Состояние лимитеров внешних API (активные запросы, очереди) и счетчики повторов"""
+    return {
+        "limits": upstream_limits.stats(),
+        "retries": upstream_callers.stats(),
+        "webhooks": webhook_notifier.stats()
+    }
+
+@app.get("/api/v1/admin/circuits",
+         tags=["admin"])
+async def get_circuits(admin: dict = Depends(verify_admin)):
+    """Состояние выключателей внешних API (в пределах текущего воркера)"""
+    return upstream_callers.circuit_stats()
+
+@app.post("/api/v1/admin/circuits/{circuit}/reset",
+          tags=["admin"])
+async def reset_circuit(circuit: str, admin: dict = Depends(verify_admin)):
+    """Принудительно замыкает выключатель внешнего API"""
+    breaker = upstream_callers.breaker(circuit)
+    if breaker is None:
+        raise HTTPException(404, "Circuit not found")
+    breaker.reset()
+    return breaker.stats()
+
+@app.get("/api/v1/admin/cache",
+         tags=["admin"])
+async def get_cache_stats(admin: dict = Depends(verify_admin)):
+    """Статистика кэшей результатов обработки и классификации"""
+    return {
+        "results": result_cache.stats(),
+        "classification": classification_cache.stats()
+    }
+
+@app.get("/api/v1/admin/results",
+         tags=["admin"])
+async def get_result_store_stats(admin: dict = Depends(verify_admin)):
+    """Состояние хранилища архивов с результатами задач"""
+    return result_store.stats()
+
+@app.get("/api/v1/admin/queue",
+         tags=["admin"])
+async def get_queue_stats(admin: dict = Depends(verify_admin)):
+    """Состояние очереди задач обработки"""
+    return job_queue.stats()
+
+@app.get("/api/v1/admin/cpu",
+         tags=["admin"])
+async def get_cpu_stats(admin: dict = Depends(verify_admin)):
+    """Режим пула обработки изображений и время операций"""
+    return cpu_executor.stats()
+
 # ==================== TOKENS ENDPOINTS ====================
 '''
 @app.post("/admin/tokens/{username}/regenerate",
@@ -278,14 +690,14 @@ async def regenerate_api_key(
 ):
     """Перегенерация API ключа для пользователя"""
     try:
-        new_api_key = auth_manager.regenerate_api_key(username, admin)
+        new_api_key = await auth_manager.regenerate_api_key(username, admin)
         
         return {
             "username": username,
             "new_api_key": new_api_key,
             "message": "API key regenerated successfully"
         }
-        
+    
     except (PermissionError, ValueError) as e:
         raise HTTPException(400, str(e))
     except Exception as e:
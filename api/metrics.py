@@ -0,0 +1,246 @@
+import math
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Границы корзин гистограмм задержек (секунды): от миллисекунд Pillow до минут генерации
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric:
+    """Метрика с метками: значения по каждому набору меток хранятся в дочернем объекте"""
+    
+    # Обновления идут из потока event loop, поэтому блокировок нет:
+    # на горячем пути - поиск в словаре и сложение
+    type_name = ""
+    
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = (), registry: Optional["MetricsRegistry"] = None):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        (registry or metrics_registry).register(self)
+    
+    def _new_child(self):
+        raise NotImplementedError
+    
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}: expected labels {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+    
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+    
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.type_name}",
+            *self._samples()
+        ]
+
+class _CounterChild:
+    __slots__ = ("value",)
+    
+    def __init__(self):
+        self.value = 0.0
+    
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+    
+    type_name = "counter"
+    
+    def _new_child(self):
+        return _CounterChild()
+    
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+    
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+            for values, child in self._children.items()
+        ]
+
+class _GaugeChild:
+    __slots__ = ("value",)
+    
+    def __init__(self):
+        self.value = 0.0
+    
+    def set(self, value: float):
+        self.value = value
+    
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+    
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+class Gauge(_Metric):
+    """Текущее значение (может уменьшаться)"""
+    
+    type_name = "gauge"
+    
+    def _new_child(self):
+        return _GaugeChild()
+    
+    def set(self, value: float):
+        self.labels().set(value)
+    
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+    
+    def dec(self, amount: float = 1.0):
+        self.labels().dec(amount)
+    
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+            for values, child in self._children.items()
+        ]
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+    
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # Последняя корзина - +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам (накопительно, как в Prometheus)"""
+    
+    type_name = "histogram"
+    
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS, registry: Optional["MetricsRegistry"] = None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, description, labelnames, registry)
+    
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+    
+    def observe(self, value: float):
+        self.labels().observe(value)
+    
+    def time(self):
+        return self.labels().time()
+    
+    def _samples(self) -> List[str]:
+        lines = []
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, values, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+class MetricsRegistry:
+    """Реестр метрик процесса и вывод в текстовом формате Prometheus"""
+    
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+    
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        # Функции, обновляющие значения по состоянию компонентов перед выводом
+        self._collectors: List[Callable[[], None]] = []
+    
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+    
+    def add_collector(self, collector: Callable[[], None]):
+        self._collectors.append(collector)
+    
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+# Глобальный реестр метрик
+metrics_registry = MetricsRegistry()
+
+# Задачи и очередь
+queue_wait_seconds = Histogram("image_api_queue_wait_seconds", "Time a task waits in the processing queue")
+task_seconds = Histogram("image_api_task_seconds", "Task processing time", ["processing_type"])
+files_processed_total = Counter("image_api_files_processed_total", "Processed files", ["processing_type", "outcome"])
+queue_depth = Gauge("image_api_queue_depth", "Tasks waiting in the processing queue")
+active_tasks = Gauge("image_api_active_tasks", "Tasks being processed")
+
+# Прием загрузок
+upload_spool_seconds = Histogram("image_api_upload_spool_seconds", "Time to spool a request's uploads to disk")
+upload_bytes_total = Counter("image_api_upload_bytes_total", "Uploaded bytes spooled to disk")
+upload_read_seconds = Histogram("image_api_upload_read_seconds", "Time to read a spooled upload for processing")
+
+# Внешние API
+upstream_request_seconds = Histogram(
+    "image_api_upstream_request_seconds", "Upstream call latency per attempt", ["upstream", "outcome"]
+)
+upstream_retries_total = Counter("image_api_upstream_retries_total", "Retried upstream attempts", ["upstream"])
+upstream_hedges_total = Counter("image_api_upstream_hedges_total", "Hedged duplicate upstream requests", ["upstream"])
+upstream_active = Gauge("image_api_upstream_active", "Upstream requests holding a limiter slot", ["upstream"])
+upstream_waiters = Gauge("image_api_upstream_waiters", "Requests waiting for an upstream limiter slot", ["upstream"])
+circuit_state = Gauge("image_api_circuit_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)", ["circuit"])
+
+# CPU и архивы
+cpu_task_seconds = Histogram("image_api_cpu_task_seconds", "Pillow work in the CPU pool, including queueing", ["operation"])
+zip_write_seconds = Histogram("image_api_zip_write_seconds", "Result archive write time", ["operation"])
+
+# Кэши и память
+cache_hit_ratio = Gauge("image_api_cache_hit_ratio", "Cache hit ratio since start", ["cache"])
+memory_bytes = Gauge("image_api_memory_bytes", "Bytes held in memory", ["component"])
+
+# Отправка логов
+log_records_buffered = Gauge("image_api_log_records_buffered", "Log records waiting to be sent")
+log_records_dropped = Gauge("image_api_log_records_dropped", "Log records dropped on buffer overflow since start")
+
+# События задач и webhook
+task_event_subscribers = Gauge("image_api_task_event_subscribers", "Open task event streams")
+webhook_deliveries_total = Counter("image_api_webhook_deliveries_total", "Task completion webhooks", ["outcome"])
+
+# HTTP
+http_requests_total = Counter("image_api_http_requests_total", "HTTP requests", ["method", "route", "status"])
+http_request_seconds = Histogram("image_api_http_request_seconds", "HTTP request latency", ["method", "route"])
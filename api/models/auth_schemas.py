@@ -6,6 +6,7 @@ class UserCreate(BaseModel):
     username: str
     is_admin: bool = False
     rate_limit: int = 100
+    priority: int = 0
 
 class UserResponse(BaseModel):
     username: str
@@ -13,6 +14,7 @@ class UserResponse(BaseModel):
     created_at: Optional[float] = None
     last_used: Optional[float] = None
     rate_limit: int
+    priority: int = 0
     is_active: bool
 
 class APIKeyResponse(BaseModel):
@@ -23,4 +25,5 @@ class APIKeyResponse(BaseModel):
 class UserUpdate(BaseModel):
     is_admin: Optional[bool] = None
     rate_limit: Optional[int] = None
+    priority: Optional[int] = None
     is_active: Optional[bool] = None
\ No newline at end of file
@@ -14,6 +14,7 @@ class ProcessingResponse(BaseModel):
     message: str
     file_count: Optional[int] = 0
     task_id: Optional[str] = None
+    queue_position: Optional[int] = None
     error: Optional[str] = None
 
 class TaskStatusResponse(BaseModel):
@@ -24,8 +25,21 @@ class TaskStatusResponse(BaseModel):
     total_files: Optional[int] = 0
     start_time: Optional[datetime] = None
     end_time: Optional[datetime] = None
+    queue_position: Optional[int] = None
     error: Optional[str] = None
 
+class TaskFileInfo(BaseModel):
+    name: str
+    size: int
+    completed_at: datetime
+
+class TaskFilesResponse(BaseModel):
+    task_id: str
+    status: TaskStatus
+    processed_files: Optional[int] = 0
+    total_files: Optional[int] = 0
+    files: List[TaskFileInfo] = []
+
 class ImageResponse(BaseModel):
     filename: str
     size: int
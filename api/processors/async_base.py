@@ -1,19 +1,61 @@
 import asyncio
 import aiofiles
-import zipfile 
+import hashlib
 import io
+import time
 from pathlib import Path
-from typing import List, Tuple, Optional, Callable
+from typing import List, Tuple, Optional, Callable, AsyncIterator, Dict, Any
 from fastapi import UploadFile
 from ..logging import CustomLogger
+from ..streaming import build_zip
+from ..cpu_executor import cpu_executor
+from ..metrics import upload_read_seconds
+from interior.image_processor import ImageProcessor
+
+# Результат обработки файла: (файл, (данные, имя) или None, ошибка или None)
+FileResult = Tuple[UploadFile, Optional[Tuple[bytes, str]], Optional[Exception]]
+
+class StageStats:
+    """Пропускная способность стадии обработки"""
+    
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.failures = 0
+        self.busy_seconds = 0.0
+        self._first_started: Optional[float] = None
+        self._last_finished: Optional[float] = None
+    
+    def record(self, started: float, success: bool = True):
+        """Учитывает обработку одного элемента, начатую в момент started"""
+        finished = time.monotonic()
+        self.items += 1
+        self.failures += 0 if success else 1
+        self.busy_seconds += finished - started
+        self._first_started = started if self._first_started is None else min(self._first_started, started)
+        self._last_finished = finished
+    
+    def summary(self) -> Dict[str, Any]:
+        elapsed = (self._last_finished - self._first_started) if self.items else 0.0
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "items": self.items,
+            "failures": self.failures,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "items_per_second": round(self.items / elapsed, 3) if elapsed > 0 else 0.0
+        }
 
 class AsyncBaseProcessor:
     """Базовый асинхронный класс для обработчиков изображений"""
     
-    def __init__(self, processing_type: str):
+    def __init__(self, processing_type: str, owner: str = "default"):
         self.processing_type = processing_type
-        self.semaphore = asyncio.Semaphore(5)
+        # Владелец обращений к внешним API (ID задачи) для справедливого распределения лимитов
+        self.owner = owner
         self.progress_callback: Optional[Callable] = None
+        self.stage_stats: Dict[str, StageStats] = {}
     
     def set_progress_callback(self, callback: Callable):
         """Устанавливает callback для отслеживания прогресса"""
@@ -27,16 +69,27 @@ class AsyncBaseProcessor:
     
     async def save_uploaded_file(self, file: UploadFile) -> bytes:
         """Сохраняет загруженный файл в память"""
-        content = await file.read()
+        with upload_read_seconds.time():
+            content = await file.read()
         return content
     
+    async def image_digest(self, file: UploadFile, image_data: bytes) -> str:
+        """SHA-256 содержимого файла: для файлов из спула он уже посчитан при приеме, иначе считается вне event loop"""
+        digest = getattr(file, "sha256", None)
+        if digest is None:
+            digest = await asyncio.to_thread(lambda: hashlib.sha256(image_data).hexdigest())
+        return digest
+    
+    async def prepare_upload(self, image_data: bytes, max_edge: int, quality: int) -> Tuple[bytes, str]:
+        """Уменьшает и перекодирует изображение перед отправкой во внешний API"""
+        return await cpu_executor.run(ImageProcessor.prepare_for_upload, image_data, max_edge, quality)
+    
     async def create_zip_response(self, processed_files: List[Tuple[str, bytes]]) -> io.BytesIO:
         """Создает zip-архив с обработанными файлами"""
         zip_buffer = io.BytesIO()
         
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for filename, file_data in processed_files:
-                zip_file.writestr(filename, file_data)
+        # Сборка архива не блокирует event loop
+        await asyncio.to_thread(build_zip, processed_files, zip_buffer)
         
         zip_buffer.seek(0)
         return zip_buffer
@@ -45,6 +98,33 @@ class AsyncBaseProcessor:
         """Обрабатывает одно изображение"""
         raise NotImplementedError("Subclasses must implement process_single")
     
+    async def process_stream(self, files: List[UploadFile], concurrency: int, logger: CustomLogger) -> AsyncIterator[FileResult]:
+        """Обрабатывает файлы параллельно (не более concurrency одновременно), отдавая результаты по мере готовности"""
+        total_files = len(files)
+        semaphore = asyncio.Semaphore(concurrency)
+        stats = StageStats("processing", concurrency)
+        self.stage_stats = {stats.name: stats}
+        
+        async def process_file(index: int, file: UploadFile) -> FileResult:
+            async with semaphore:
+                logger.info("Обработка файла %d/%d: %s", index + 1, total_files, file.filename)
+                started = time.monotonic()
+                try:
+                    result = await self.process_single(file)
+                except Exception as e:
+                    stats.record(started, success=False)
+                    return file, None, e
+                stats.record(started)
+                return file, result, None
+        
+        jobs = [asyncio.create_task(process_file(i, file)) for i, file in enumerate(files)]
+        try:
+            for job in asyncio.as_completed(jobs):
+                yield await job
+        finally:
+            for job in jobs:
+                job.cancel()
+    
     async def process_batch(self, files: List[UploadFile]) -> io.BytesIO:
         """Обрабатывает батч файлов"""
         raise NotImplementedError("Subclasses must implement process_batch")
\ No newline at end of file
@@ -1,23 +1,111 @@
 import io
-from typing import List, Tuple
+import time
+from dataclasses import dataclass
+from typing import List, Tuple, Optional, AsyncIterator
 from fastapi import UploadFile
 import asyncio
-from PIL import Image
 
-from .async_base import AsyncBaseProcessor
+from .async_base import AsyncBaseProcessor, StageStats, FileResult
 from interior.async_ai_client import AsyncAIClient
 from interior.config import Config
+from interior.image_processor import ImageProcessor
 from ..logging import CustomLogger
+from ..clients import client_registry
+from ..cache import result_cache
+from ..cpu_executor import cpu_executor
+
+@dataclass
+class ClassifiedImage:
+    """Изображение между стадиями классификации и генерации"""
+    file: UploadFile
+    logger: CustomLogger
+    image_data: bytes
+    main_category: str
+    subcategory: str
+    prompt: str
+    output_filename: str
+    cache_key: str
+    cached_data: Optional[bytes] = None
 
 class AsyncInteriorProcessor(AsyncBaseProcessor):
     """Асинхронный обработчик для интерьеров"""
     
-    def __init__(self):
-        super().__init__("interior")
-        self.ai_client = AsyncAIClient()
+    def __init__(self, ai_client: Optional[AsyncAIClient] = None, owner: str = "default"):
+        super().__init__("interior", owner)
+        self.ai_client = ai_client or client_registry.ai
     
     async def process_single(self, file: UploadFile) -> Tuple[bytes, str]:
         """Обрабатывает одно изображение для интерьера"""
+        item = await self._classify(file)
+        if item.cached_data is not None:
+            return item.cached_data, item.output_filename
+        return await self._generate(item)
+    
+    async def process_stream(self, files: List[UploadFile], concurrency: int, logger: CustomLogger) -> AsyncIterator[FileResult]:
+        """Конвейер: классификация следующих изображений идет, пока генерируются предыдущие"""
+        total_files = len(files)
+        classify_workers = max(1, min(Config.CLASSIFICATION_STAGE_WORKERS, total_files))
+        generate_workers = max(1, min(concurrency, total_files))
+        classify_stats = StageStats("classification", classify_workers)
+        generate_stats = StageStats("generation", generate_workers)
+        self.stage_stats = {classify_stats.name: classify_stats, generate_stats.name: generate_stats}
+        
+        pending = iter(enumerate(files))
+        # Ограниченная очередь не дает классификации уйти далеко вперед с исходниками в памяти
+        classified: asyncio.Queue = asyncio.Queue(maxsize=max(1, Config.PIPELINE_QUEUE_SIZE))
+        results: asyncio.Queue = asyncio.Queue()
+        
+        async def classify_worker():
+            for index, file in pending:
+                logger.info("Классификация файла %d/%d: %s", index + 1, total_files, file.filename)
+                started = time.monotonic()
+                try:
+                    item = await self._classify(file)
+                except Exception as e:
+                    classify_stats.record(started, success=False)
+                    await results.put((file, None, e))
+                    continue
+                classify_stats.record(started)
+                
+                if item.cached_data is not None:
+                    await results.put((file, (item.cached_data, item.output_filename), None))
+                else:
+                    await classified.put(item)
+        
+        async def generate_worker():
+            while True:
+                item = await classified.get()
+                if item is None:
+                    return
+                logger.info("Генерация для файла: %s", item.file.filename)
+                started = time.monotonic()
+                try:
+                    result = await self._generate(item)
+                except Exception as e:
+                    generate_stats.record(started, success=False)
+                    await results.put((item.file, None, e))
+                    continue
+                generate_stats.record(started)
+                await results.put((item.file, result, None))
+        
+        async def close_stage(classifiers):
+            # Когда классификация закончилась, останавливаем генераторы
+            await asyncio.gather(*classifiers)
+            for _ in range(generate_workers):
+                await classified.put(None)
+        
+        classifiers = [asyncio.create_task(classify_worker()) for _ in range(classify_workers)]
+        generators = [asyncio.create_task(generate_worker()) for _ in range(generate_workers)]
+        workers = classifiers + generators + [asyncio.create_task(close_stage(classifiers))]
+        try:
+            for _ in range(total_files):
+                yield await results.get()
+        finally:
+            for worker in workers:
+                worker.cancel()
+    
+    async def _classify(self, file: UploadFile) -> ClassifiedImage:
+        """Первая стадия: чтение, классификация, промпт и проверка кэша результата"""
         logger = CustomLogger("interior")
         
         try:
@@ -26,47 +114,95 @@ class AsyncInteriorProcessor(AsyncBaseProcessor):
             # Читаем файл
             image_data = await self.save_uploaded_file(file)
             
-            # Анализируем категорию
-            async with self.semaphore:
-                main_category, subcategory = await self.ai_client.analyze_thematic_subcategory(
-                    image_data, logger
+            # Для классификации отправляем миниатюру
+            thumbnail_data, thumbnail_type = await self.prepare_upload(
+                image_data, Config.CLASSIFICATION_MAX_EDGE, Config.CLASSIFICATION_JPEG_QUALITY
+            )
+            
+            # Анализируем категорию; попадание в кэш не обращается к API, слот лимитера chat
+            # занимает только сам запрос (паузы между повторами слот не держат)
+            cache_key, categories = await self.ai_client.cached_subcategory(thumbnail_data)
+            if categories is None:
+                categories = await self.ai_client.analyze_thematic_subcategory(
+                    thumbnail_data, logger, thumbnail_type, cache_key=cache_key, owner=self.owner
                 )
+            main_category, subcategory = categories
             
             logger.info(f"Категория для {file.filename}: {main_category} - {subcategory}")
             
             # Генерируем промпт
             prompt = self._generate_context_prompt(main_category, subcategory)
+            item = ClassifiedImage(
+                file=file,
+                logger=logger,
+                image_data=image_data,
+                main_category=main_category,
+                subcategory=subcategory,
+                prompt=prompt,
+                output_filename=f"{file.filename.split('.')[0]}_in_{main_category.lower()}.jpg",
+                # Повторно присланное изображение с тем же промптом отдаем из кэша
+                cache_key=result_cache.make_key(
+                    await self.image_digest(file, image_data),
+                    processor="interior",
+                    prompt=prompt,
+                    model=Config.IMAGE_MODEL,
+                    max_edge=Config.GENERATION_MAX_EDGE,
+                    quality=Config.GENERATION_JPEG_QUALITY
+                )
+            )
             
-            # Генерируем изображение
-            async with self.semaphore:
-                processed_data = await self.ai_client.edit_image_with_gemini(
-                    image_data, prompt, logger
+            item.cached_data = await result_cache.get(item.cache_key)
+            if item.cached_data is not None:
+                logger.info(f"Результат взят из кэша: {file.filename}")
+                logger.finish_success(
+                    filename=file.filename,
+                    category=main_category,
+                    subcategory=subcategory,
+                    cached=True
                 )
             
+            return item
+            
+        except Exception as e:
+            logger.error(f"Ошибка при обработке {file.filename}: {e}")
+            logger.finish_error(error=str(e))
+            raise
+    
+    async def _generate(self, item: ClassifiedImage) -> Tuple[bytes, str]:
+        """Вторая стадия: генерация изображения по готовому промпту"""
+        logger = item.logger
+        
+        try:
+            # Уменьшаем оригинал перед генерацией
+            upload_data, upload_type = await self.prepare_upload(
+                item.image_data, Config.GENERATION_MAX_EDGE, Config.GENERATION_JPEG_QUALITY
+            )
+            # Исходник дальше не нужен, не держим его в очереди конвейера
+            item.image_data = b""
+            
+            # Генерируем изображение; слот лимитера image занимает каждая попытка запроса
+            processed_data = await self.ai_client.edit_image_with_gemini(
+                upload_data, item.prompt, logger, upload_type, owner=self.owner
+            )
+            
             if not processed_data:
                 raise Exception("Image generation failed")
             
-            # Обрезаем до 3:4 (синхронно, но быстро)
-            processed_image = Image.open(io.BytesIO(processed_data))
-            cropped_image = self._crop_to_3_4(processed_image)
-            
-            # Сохраняем в bytes
-            output_buffer = io.BytesIO()
-            cropped_image.save(output_buffer, format="JPEG", quality=95)
-            processed_data = output_buffer.getvalue()
+            # Обрезаем до 3:4 и кодируем в JPEG в пуле CPU, не блокируя event loop
+            processed_data = await cpu_executor.run(ImageProcessor.crop_to_3_4_jpeg, processed_data, 95)
+            await result_cache.put(item.cache_key, processed_data)
             
-            output_filename = f"{file.filename.split('.')[0]}_in_{main_category.lower()}.jpg"
-            logger.info(f"Успешно обработан: {file.filename}")
+            logger.info(f"Успешно обработан: {item.file.filename}")
             logger.finish_success(
-                filename=file.filename,
-                category=main_category,
-                subcategory=subcategory
+                filename=item.file.filename,
+                category=item.main_category,
+                subcategory=item.subcategory
             )
             
-            return processed_data, output_filename
+            return processed_data, item.output_filename
             
         except Exception as e:
-            logger.error(f"Ошибка при обработке {file.filename}: {e}")
+            logger.error(f"Ошибка при обработке {item.file.filename}: {e}")
             logger.finish_error(error=str(e))
             raise
     
@@ -75,20 +211,6 @@ class AsyncInteriorProcessor(AsyncBaseProcessor):
         # Ваша существующая логика генерации промпта
         return f"... {main_category} ... {subcategory} ..."
     
-    def _crop_to_3_4(self, image: Image.Image) -> Image.Image:
-        """Обрезает изображение до 3:4 (синхронно)"""
-        width, height = image.size
-        target_ratio = 3/4
-        
-        if width / height > target_ratio:
-            new_width = int(height * target_ratio)
-            left = (width - new_width) // 2
-            return image.crop((left, 0, left + new_width, height))
-        else:
-            new_height = int(width / target_ratio)
-            top = (height - new_height) // 2
-            return image.crop((0, top, width, top + new_height))
-    
     async def process_batch(self, files: List[UploadFile]) -> io.BytesIO:
         """Обрабатывает батч файлов для интерьеров"""
         # Аналогично AsyncWhiteProcessor
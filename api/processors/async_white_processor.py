@@ -1,18 +1,21 @@
 import io
-from typing import List, Tuple
+from typing import List, Tuple, Optional
 from fastapi import UploadFile
 import asyncio
 
 from .async_base import AsyncBaseProcessor
 from white.async_pixian_client import AsyncPixianClient
+from white.config import Config as WhiteConfig
 from ..logging import CustomLogger
+from ..clients import client_registry
+from ..cache import result_cache
 
 class AsyncWhiteProcessor(AsyncBaseProcessor):
     """Асинхронный обработчик для белого фона"""
     
-    def __init__(self):
-        super().__init__("white")
-        self.pixian_client = AsyncPixianClient()
+    def __init__(self, pixian_client: Optional[AsyncPixianClient] = None, owner: str = "default"):
+        super().__init__("white", owner)
+        self.pixian_client = pixian_client or client_registry.pixian
     
     async def process_single(self, file: UploadFile) -> Tuple[bytes, str]:
         """Обрабатывает одно изображение"""
@@ -23,18 +26,43 @@ class AsyncWhiteProcessor(AsyncBaseProcessor):
             
             # Читаем файл
             image_data = await self.save_uploaded_file(file)
+            output_filename = f"{file.filename.split('.')[0]}_white_test.png"
             
-            # Обрабатываем с ограничением параллелизма
-            async with self.semaphore:
-                success, processed_data, error_msg = await self.pixian_client.remove_background(
-                    image_data, logger
+            # Повторно присланное изображение отдаем из кэша
+            cache_key = result_cache.make_key(
+                await self.image_digest(file, image_data),
+                processor="pixian",
+                background_color=WhiteConfig.BACKGROUND_COLOR,
+                test=WhiteConfig.TEST_MODE,
+                max_edge=WhiteConfig.UPLOAD_MAX_EDGE,
+                quality=WhiteConfig.UPLOAD_JPEG_QUALITY
+            )
+            cached_data = await result_cache.get(cache_key)
+            if cached_data is not None:
+                logger.info(f"Результат взят из кэша: {file.filename}")
+                logger.finish_success(
+                    filename=file.filename,
+                    processed_filename=output_filename,
+                    cached=True
                 )
+                return cached_data, output_filename
+            
+            # Уменьшаем оригинал перед отправкой
+            upload_data, content_type = await self.prepare_upload(
+                image_data, WhiteConfig.UPLOAD_MAX_EDGE, WhiteConfig.UPLOAD_JPEG_QUALITY
+            )
+            
+            # Обрабатываем с общим для процесса ограничением обращений к Pixian (слот на каждую попытку)
+            success, processed_data, error_msg = await self.pixian_client.remove_background(
+                upload_data, logger, content_type, owner=self.owner
+            )
             
             if not success:
                 logger.error(f"Ошибка обработки {file.filename}: {error_msg}")
                 raise Exception(f"Processing failed: {error_msg}")
             
-            output_filename = f"{file.filename.split('.')[0]}_white_test.png"
+            await result_cache.put(cache_key, processed_data)
+            
             logger.info(f"Успешно обработан: {file.filename}")
             logger.finish_success(
                 filename=file.filename,
@@ -0,0 +1,323 @@
+import asyncio
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from .config import Config
+from .limiter import UpstreamLimits, upstream_limits
+from .logging import CustomLogger
+from .metrics import upstream_request_seconds, upstream_retries_total, upstream_hedges_total
+
+T = TypeVar("T")
+
+# HTTP-статусы, после которых запрос имеет смысл повторить
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+class RetryableError(Exception):
+    """Временная ошибка внешнего API: запрос можно повторить"""
+    
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class CircuitOpenError(Exception):
+    """Выключатель разомкнут: запрос отклонен без обращения к внешнему API"""
+    
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} is unavailable (circuit open, retry in {retry_in:.1f}s)")
+        self.name = name
+        self.retry_in = retry_in
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Разбирает заголовок Retry-After (секунды или HTTP-дата) в секунды ожидания"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def default_retryable(error: BaseException) -> Tuple[bool, Optional[float]]:
+    """Повторяем явные временные ошибки и таймауты попытки"""
+    if isinstance(error, RetryableError):
+        return True, error.retry_after
+    if isinstance(error, asyncio.TimeoutError):
+        return True, None
+    return False, None
+
+@dataclass
+class RetryPolicy:
+    """Политика повторов запросов к внешнему API"""
+    name: str
+    attempts: int
+    attempt_timeout: float
+    base_delay: float
+    max_delay: float
+    # Через сколько секунд без ответа отправлять дублирующий запрос (0 - без дублирования)
+    hedge_after: float = 0.0
+    
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Экспоненциальная задержка с полным джиттером; Retry-After сервера важнее"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, Config.RETRY_AFTER_MAX))
+        return delay
+
+class CircuitBreaker:
+    """Автоматический выключатель по доле ошибок в скользящем окне с пробными запросами"""
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, name: str, window: float, min_requests: int, failure_rate: float, open_seconds: float, half_open_probes: int):
+        self.name = name
+        self.window = window
+        self.min_requests = min_requests
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = max(1, half_open_probes)
+        self.state = self.CLOSED
+        # (время, успех) запросов за последние window секунд
+        self._events: deque = deque()
+        self._opened_at = 0.0
+        self._probes = 0
+        self._stats = {"opened": 0, "rejected": 0}
+    
+    def allow(self):
+        """Проверяет, можно ли отправить запрос; иначе CircuitOpenError"""
+        if self.state == self.OPEN:
+            retry_in = self._opened_at + self.open_seconds - time.monotonic()
+            if retry_in > 0:
+                self._stats["rejected"] += 1
+                raise CircuitOpenError(self.name, retry_in)
+            self.state, self._probes = self.HALF_OPEN, 0
+        
+        if self.state == self.HALF_OPEN:
+            if self._probes >= self.half_open_probes:
+                self._stats["rejected"] += 1
+                raise CircuitOpenError(self.name, self.open_seconds)
+            self._probes += 1
+    
+    def record(self, success: bool):
+        """Учитывает исход запроса, пропущенного allow()"""
+        if self.state == self.HALF_OPEN:
+            if success:
+                self.reset()
+            else:
+                self._trip()
+            return
+        if self.state == self.OPEN:
+            # Ответы на запросы, отправленные до размыкания, уже ничего не решают
+            return
+        
+        now = time.monotonic()
+        self._events.append((now, success))
+        self._trim(now)
+        failures = sum(1 for _, ok in self._events if not ok)
+        if len(self._events) >= self.min_requests and failures / len(self._events) >= self.failure_rate:
+            self._trip()
+    
+    def release(self):
+        """Запрос отменен, не дав результата: освобождаем место пробного запроса"""
+        if self.state == self.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+    
+    def reset(self):
+        """Замыкает выключатель и очищает окно"""
+        self.state = self.CLOSED
+        self._events.clear()
+        self._probes = 0
+    
+    def _trip(self):
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._events.clear()
+        self._stats["opened"] += 1
+    
+    def _trim(self, now: float):
+        while self._events and now - self._events[0][0] > self.window:
+            self._events.popleft()
+    
+    def stats(self) -> Dict[str, Any]:
+        self._trim(time.monotonic())
+        failures = sum(1 for _, ok in self._events if not ok)
+        stats = {
+            "state": self.state,
+            "window_requests": len(self._events),
+            "window_failures": failures,
+            **self._stats
+        }
+        if self.state == self.OPEN:
+            stats["retry_in"] = round(max(0.0, self._opened_at + self.open_seconds - time.monotonic()), 1)
+        return stats
+
+class ResilientCaller:
+    """Вызов внешнего API с таймаутом попытки, повторами и дублированием медленных запросов"""
+    
+    def __init__(self, policy: RetryPolicy, breaker: Optional[CircuitBreaker] = None, limits: Optional[UpstreamLimits] = None):
+        self.policy = policy
+        self.breaker = breaker
+        # Слот лимитера внешнего API занимает каждая попытка и каждый дубликат, но не пауза между попытками
+        self.limits = limits
+        self._stats = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "failures": 0}
+    
+    async def call(
+        self,
+        operation: Callable[[], Awaitable[T]],
+        logger: Optional[CustomLogger] = None,
+        retryable: Callable[[BaseException], Tuple[bool, Optional[float]]] = default_retryable,
+        owner: str = "default"
+    ) -> T:
+        """Выполняет operation, повторяя временные ошибки; последняя ошибка пробрасывается.
+        owner - владелец запросов (задача) для справедливой очереди лимитера"""
+        self._stats["calls"] += 1
+        for attempt in range(self.policy.attempts):
+            if self.breaker:
+                try:
+                    self.breaker.allow()
+                except CircuitOpenError:
+                    self._stats["failures"] += 1
+                    raise
+            started = time.perf_counter()
+            try:
+                result = await self._attempt(operation, owner)
+            except asyncio.CancelledError:
+                if self.breaker:
+                    self.breaker.release()
+                raise
+            except Exception as e:
+                should_retry, retry_after = retryable(e)
+                outcome = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+                upstream_request_seconds.labels(self.policy.name, outcome).observe(time.perf_counter() - started)
+                # Постоянные ошибки (например, 4xx) говорят о запросе, а не о состоянии API
+                if self.breaker:
+                    self.breaker.record(success=not should_retry)
+                if not should_retry or attempt == self.policy.attempts - 1:
+                    self._stats["failures"] += 1
+                    raise
+                delay = self.policy.backoff(attempt, retry_after)
+                self._stats["retries"] += 1
+                upstream_retries_total.labels(self.policy.name).inc()
+                if logger:
+                    logger.warning(
+                        f"{self.policy.name}: попытка {attempt + 1}/{self.policy.attempts} не удалась ({e}), "
+                        f"повтор через {delay:.1f} с"
+                    )
+                await asyncio.sleep(delay)
+            else:
+                upstream_request_seconds.labels(self.policy.name, "ok").observe(time.perf_counter() - started)
+                if self.breaker:
+                    self.breaker.record(success=True)
+                return result
+    
+    async def _attempt(self, operation: Callable[[], Awaitable[T]], owner: str) -> T:
+        """Одна попытка; если ответ задерживается, параллельно отправляется дубликат"""
+        if self.policy.hedge_after <= 0:
+            return await self._limited(operation, owner)
+        
+        acquired = asyncio.Event()
+        primary = asyncio.create_task(self._limited(operation, owner, acquired))
+        hedge: Optional[asyncio.Task] = None
+        pending = {primary}
+        error: Optional[BaseException] = None
+        try:
+            # Задержка до дубликата отсчитывается от отправки запроса, а не от начала ожидания слота
+            waiter = asyncio.create_task(acquired.wait())
+            await asyncio.wait({primary, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            
+            done, _ = await asyncio.wait(pending, timeout=self.policy.hedge_after)
+            if not done:
+                self._stats["hedges"] += 1
+                upstream_hedges_total.labels(self.policy.name).inc()
+                hedge = asyncio.create_task(self._limited(operation, owner))
+                pending.add(hedge)
+            
+            # Берем первый успешный ответ; ошибка важна, только если упали все запросы
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._stats["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def _limited(self, operation: Callable[[], Awaitable[T]], owner: str, acquired: Optional[asyncio.Event] = None) -> T:
+        """Запрос в слоте лимитера: слот занят только на время самого запроса"""
+        if self.limits is None:
+            if acquired:
+                acquired.set()
+            return await self._timed(operation)
+        async with self.limits.get(self.policy.name).slot(owner):
+            if acquired:
+                acquired.set()
+            return await self._timed(operation)
+    
+    async def _timed(self, operation: Callable[[], Awaitable[T]]) -> T:
+        if self.policy.attempt_timeout <= 0:
+            return await operation()
+        return await asyncio.wait_for(operation(), timeout=self.policy.attempt_timeout)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "attempts": self.policy.attempts,
+            "attempt_timeout": self.policy.attempt_timeout,
+            "hedge_after": self.policy.hedge_after,
+            **self._stats
+        }
+
+class UpstreamCallers:
+    """Вызывающие с политикой повторов для каждого внешнего API и выключатели по сервисам"""
+    
+    def __init__(self, settings: Dict[str, Dict[str, Any]]):
+        # Один выключатель на сервис: модели chat и image работают через один шлюз
+        self._breakers = {
+            circuit: CircuitBreaker(
+                circuit,
+                window=Config.CIRCUIT_WINDOW_SECONDS,
+                min_requests=Config.CIRCUIT_MIN_REQUESTS,
+                failure_rate=Config.CIRCUIT_FAILURE_RATE,
+                open_seconds=Config.CIRCUIT_OPEN_SECONDS,
+                half_open_probes=Config.CIRCUIT_HALF_OPEN_PROBES
+            )
+            for circuit in {values["circuit"] for values in settings.values()}
+        }
+        self._callers = {
+            name: ResilientCaller(RetryPolicy(
+                name=name,
+                attempts=max(1, int(values["attempts"])),
+                attempt_timeout=values["attempt_timeout"],
+                base_delay=Config.RETRY_BASE_DELAY,
+                max_delay=Config.RETRY_MAX_DELAY,
+                hedge_after=values["hedge_after"]
+            ), self._breakers[values["circuit"]], upstream_limits)
+            for name, values in settings.items()
+        }
+    
+    def get(self, name: str) -> ResilientCaller:
+        return self._callers[name]
+    
+    def breaker(self, circuit: str) -> Optional[CircuitBreaker]:
+        return self._breakers.get(circuit)
+    
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: caller.stats() for name, caller in self._callers.items()}
+    
+    def circuit_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {circuit: breaker.stats() for circuit, breaker in self._breakers.items()}
+
+# Глобальные политики повторов внешних API
+upstream_callers = UpstreamCallers(Config.UPSTREAM_RETRY)
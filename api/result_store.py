@@ -0,0 +1,234 @@
+import asyncio
+import io
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, Iterable, Optional, Dict, Any
+
+from fastapi.responses import StreamingResponse
+
+from .config import Config
+from .streaming import range_response, file_range_response
+
+class ResultTooLargeError(Exception):
+    """Архив задачи не помещается в лимит места хранилища"""
+
+class ResultStore:
+    """Интерфейс хранилища архивов с результатами задач"""
+    
+    def staging_path(self, task_id: str) -> Path:
+        """Путь, по которому пишется архив задачи до передачи в хранилище"""
+        raise NotImplementedError
+    
+    async def put(self, task_id: str, archive_path: Path) -> str:
+        """Принимает готовый архив и возвращает ключ результата"""
+        raise NotImplementedError
+    
+    async def reserve(self, task_id: str):
+        """Освобождает место под уже записанные файлы незавершенной задачи;
+        ResultTooLargeError, если они не помещаются в лимит"""
+        raise NotImplementedError
+    
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+    
+    def response(self, key: str, filename: str, range_header: Optional[str] = None) -> StreamingResponse:
+        """Потоковый ответ с архивом (поддерживается HTTP Range)"""
+        raise NotImplementedError
+    
+    def open(self, key: str) -> BinaryIO:
+        """Архив как файловый объект (для чтения отдельных файлов)"""
+        raise NotImplementedError
+    
+    def delete(self, key: str):
+        raise NotImplementedError
+    
+    def stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+class DiskResultStore(ResultStore):
+    """Архивы во временном каталоге с жестким лимитом на занимаемое место"""
+    
+    def __init__(self, root: Path, max_disk_bytes: int, shared_dirs: Iterable[Path] = ()):
+        self.root = Path(root)
+        self.max_disk_bytes = max_disk_bytes
+        # Каталоги, чьи файлы тоже идут в лимит, но вытесняются не этим хранилищем
+        self.shared_dirs = [Path(path) for path in shared_dirs]
+        self.evictions = 0
+        self._lock = threading.Lock()
+    
+    def _path(self, key: str) -> Path:
+        return self.root / f"{key}.zip"
+    
+    def _shared_bytes(self, exclude: Optional[str] = None) -> int:
+        total = 0
+        for directory in self.shared_dirs:
+            for dirpath, dirnames, filenames in os.walk(directory):
+                if exclude is not None and dirpath == str(directory):
+                    dirnames[:] = [name for name in dirnames if name != exclude]
+                for name in filenames:
+                    try:
+                        total += os.stat(os.path.join(dirpath, name)).st_size
+                    except FileNotFoundError:
+                        continue
+        return total
+    
+    def staging_path(self, task_id: str) -> Path:
+        return self._path(task_id)
+    
+    async def put(self, task_id: str, archive_path: Path) -> str:
+        if archive_path != self._path(task_id):
+            await asyncio.to_thread(os.replace, archive_path, self._path(task_id))
+        try:
+            # Файлы задачи по одному удаляются сразу после сохранения архива: второй раз их не считаем
+            await asyncio.to_thread(self._enforce_limit, task_id, True)
+        except ResultTooLargeError:
+            self.delete(task_id)
+            raise
+        return task_id
+    
+    async def reserve(self, task_id: str):
+        await asyncio.to_thread(self._enforce_limit, task_id, False)
+    
+    def _enforce_limit(self, keep_key: str, archive_ready: bool):
+        """Удаляет самые старые архивы, пока не уложимся в лимит (каталог общий для воркеров)"""
+        with self._lock:
+            archives = []
+            # Новый архив, недописанные (.zip.part) и готовые файлы задач занимают место, но вытеснять их нельзя
+            pinned = self._shared_bytes(exclude=keep_key if archive_ready else None)
+            for path in self.root.glob("*.zip*"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                if path.suffix == ".zip" and path.stem != keep_key:
+                    archives.append((stat.st_mtime, path, stat.st_size))
+                else:
+                    pinned += stat.st_size
+            
+            if pinned > self.max_disk_bytes:
+                # Даже после вытеснения всех архивов задача в лимит не поместится
+                raise ResultTooLargeError(
+                    f"Task result does not fit into the result store limit ({self.max_disk_bytes} bytes)"
+                )
+            
+            total = pinned + sum(size for _, _, size in archives)
+            for _, path, size in sorted(archives):
+                if total <= self.max_disk_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+                self.evictions += 1
+    
+    def exists(self, key: str) -> bool:
+        return self._path(key).exists()
+    
+    def response(self, key: str, filename: str, range_header: Optional[str] = None) -> StreamingResponse:
+        return file_range_response(self._path(key), filename, "application/zip", range_header)
+    
+    def open(self, key: str) -> BinaryIO:
+        return open(self._path(key), "rb")
+    
+    def delete(self, key: str):
+        self._path(key).unlink(missing_ok=True)
+    
+    def stats(self) -> Dict[str, Any]:
+        sizes = {}
+        for path in self.root.glob("*.zip*"):
+            try:
+                sizes[path.name] = path.stat().st_size
+            except FileNotFoundError:
+                continue
+        return {
+            "backend": "disk",
+            "archives": sum(1 for name in sizes if name.endswith(".zip")),
+            "disk_bytes": sum(sizes.values()),
+            "shared_bytes": self._shared_bytes(),
+            "max_disk_bytes": self.max_disk_bytes,
+            "evictions": self.evictions
+        }
+
+class MemoryResultStore(ResultStore):
+    """Архивы в памяти в пределах бюджета; не поместившиеся вытесняются на диск"""
+    
+    def __init__(self, memory_budget_bytes: int, spill: DiskResultStore):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.spill = spill
+        self._archives: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self.spilled = 0
+        self.evictions = 0
+    
+    def staging_path(self, task_id: str) -> Path:
+        return self.spill.staging_path(task_id)
+    
+    async def put(self, task_id: str, archive_path: Path) -> str:
+        if archive_path.stat().st_size > self.memory_budget_bytes:
+            self.spilled += 1
+            return await self.spill.put(task_id, archive_path)
+        
+        data = await asyncio.to_thread(archive_path.read_bytes)
+        archive_path.unlink(missing_ok=True)
+        self._archives[task_id] = data
+        self._memory_bytes += len(data)
+        
+        # Самые старые архивы уходят на диск
+        while self._memory_bytes > self.memory_budget_bytes:
+            key, evicted = self._archives.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.spilled += 1
+            await asyncio.to_thread(self.spill.staging_path(key).write_bytes, evicted)
+            try:
+                await self.spill.put(key, self.spill.staging_path(key))
+            except ResultTooLargeError:
+                # На диске места нет: вытесненный архив теряется, как при вытеснении с диска
+                self.evictions += 1
+        return task_id
+    
+    async def reserve(self, task_id: str):
+        # Архив пишется на диск и переезжает в память только целиком
+        await self.spill.reserve(task_id)
+    
+    def exists(self, key: str) -> bool:
+        return key in self._archives or self.spill.exists(key)
+    
+    def response(self, key: str, filename: str, range_header: Optional[str] = None) -> StreamingResponse:
+        data = self._archives.get(key)
+        if data is None:
+            return self.spill.response(key, filename, range_header)
+        return range_response(data, filename, "application/zip", range_header)
+    
+    def open(self, key: str) -> BinaryIO:
+        data = self._archives.get(key)
+        if data is None:
+            return self.spill.open(key)
+        return io.BytesIO(data)
+    
+    def delete(self, key: str):
+        data = self._archives.pop(key, None)
+        if data is not None:
+            self._memory_bytes -= len(data)
+        self.spill.delete(key)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "archives": len(self._archives),
+            "memory_bytes": self._memory_bytes,
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "spilled": self.spilled,
+            "evictions": self.evictions,
+            "disk": self.spill.stats()
+        }
+
+def create_result_store() -> ResultStore:
+    """Создает хранилище результатов по конфигурации"""
+    # Готовые файлы незавершенных задач лежат отдельно, но входят в тот же лимит места
+    disk_store = DiskResultStore(Config.RESULTS_DIR, Config.RESULT_DISK_MAX_MB * 1024 * 1024, [Config.OUTPUTS_DIR])
+    if Config.RESULT_STORE_BACKEND == "memory":
+        return MemoryResultStore(Config.RESULT_MEMORY_BUDGET_MB * 1024 * 1024, disk_store)
+    return disk_store
+
+# Глобальное хранилище результатов задач
+result_store = create_result_store()
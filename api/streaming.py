@@ -0,0 +1,186 @@
+import asyncio
+import os
+import re
+import time
+import zipfile
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from .config import Config
+from .metrics import zip_write_seconds
+
+def zip_compression_for(filename: str) -> int:
+    """Выбирает метод сжатия записи: сжатые форматы хранятся как есть"""
+    if os.path.splitext(filename)[1].lower() in Config.ZIP_STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+def build_zip(processed_files: List[Tuple[str, bytes]], target) -> None:
+    """Записывает файлы в ZIP с учетом политики сжатия (синхронно)"""
+    with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for filename, file_data in processed_files:
+            zip_file.writestr(filename, file_data, compress_type=zip_compression_for(filename))
+
+class StreamingZipWriter:
+    """Дописывает ZIP-архив на диск по мере готовности файлов"""
+    
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Пока архив не закрыт, он лежит под временным именем
+        self._part_path = self.path.with_name(self.path.name + ".part")
+        self._zip = zipfile.ZipFile(self._part_path, 'w', zipfile.ZIP_DEFLATED)
+        self._names = set()
+        # ZipFile не потокобезопасен: записи из пула потоков идут по одной
+        self._lock = asyncio.Lock()
+        self.entries = 0
+    
+    def _unique_name(self, filename: str) -> str:
+        """Не допускает одинаковых имен внутри архива"""
+        name, counter = filename, 1
+        stem, ext = os.path.splitext(filename)
+        while name in self._names:
+            name = f"{stem}_{counter}{ext}"
+            counter += 1
+        self._names.add(name)
+        return name
+    
+    def add(self, filename: str, data: bytes) -> str:
+        """Добавляет файл в архив и возвращает имя записи"""
+        name = self._unique_name(filename)
+        self._zip.writestr(name, data, compress_type=zip_compression_for(name))
+        self.entries += 1
+        return name
+    
+    async def append(self, filename: str, data: bytes) -> str:
+        """Добавляет файл в архив вне event loop"""
+        async with self._lock:
+            with zip_write_seconds.labels("append").time():
+                return await asyncio.to_thread(self.add, filename, data)
+    
+    def close(self) -> Path:
+        """Дописывает центральный каталог и публикует архив"""
+        self._zip.close()
+        os.replace(self._part_path, self.path)
+        return self.path
+    
+    async def finalize(self) -> Path:
+        """Закрывает архив вне event loop"""
+        async with self._lock:
+            with zip_write_seconds.labels("finalize").time():
+                return await asyncio.to_thread(self.close)
+    
+    def abort(self):
+        """Закрывает и удаляет недописанный архив"""
+        try:
+            self._zip.close()
+        finally:
+            self._part_path.unlink(missing_ok=True)
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Разбирает заголовок Range (один диапазон) в пару (start, end) включительно"""
+    if not range_header:
+        return None
+    
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+    if not match or match.groups() == ("", ""):
+        raise HTTPException(416, "Invalid range", headers={"Content-Range": f"bytes */{size}"})
+    
+    start, end = match.groups()
+    if start == "":
+        # Суффикс: последние N байт
+        start, end = max(0, size - int(end)), size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    
+    if start > end or start >= size:
+        raise HTTPException(416, "Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+def _range_headers(size: int, filename: str, range_header: Optional[str]) -> Tuple[int, Dict[str, str], int, int]:
+    """Код ответа, заголовки и срез (начало, длина) для запроса с необязательным Range"""
+    byte_range = parse_range(range_header, size)
+    headers = {
+        "Content-Disposition": f"attachment; filename={filename}",
+        "Accept-Ranges": "bytes"
+    }
+    
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return 200, headers, 0, size
+    
+    start, end = byte_range
+    length = end - start + 1
+    headers["Content-Length"] = str(length)
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return 206, headers, start, length
+
+async def _iter_buffer(buffer: bytes, start: int, length: int) -> AsyncIterator[bytes]:
+    """Отдает срез буфера в памяти кусками"""
+    view = memoryview(buffer)
+    try:
+        for offset in range(start, start + length, Config.DOWNLOAD_CHUNK_SIZE):
+            yield bytes(view[offset:min(offset + Config.DOWNLOAD_CHUNK_SIZE, start + length)])
+    finally:
+        view.release()
+
+def range_response(buffer: bytes, filename: str, media_type: str, range_header: Optional[str] = None) -> StreamingResponse:
+    """Потоковая отдача буфера в памяти с поддержкой HTTP Range"""
+    status_code, headers, start, length = _range_headers(len(buffer), filename, range_header)
+    return StreamingResponse(
+        _iter_buffer(buffer, start, length),
+        status_code=status_code,
+        media_type=media_type,
+        headers=headers
+    )
+
+def _read_at(file: BinaryIO, offset: int, size: int) -> bytes:
+    file.seek(offset)
+    return file.read(size)
+
+async def _iter_file(file: BinaryIO, start: int, length: int) -> AsyncIterator[bytes]:
+    """Читает срез файла кусками в пуле потоков: чтение с холодного диска не блокирует event loop"""
+    offset, end = start, start + length
+    while offset < end:
+        chunk = await asyncio.to_thread(_read_at, file, offset, min(Config.DOWNLOAD_CHUNK_SIZE, end - offset))
+        if not chunk:
+            break
+        offset += len(chunk)
+        yield chunk
+
+class FileRangeResponse(StreamingResponse):
+    """Ответ с открытым файлом; файл закрывается после отправки, в том числе при обрыве соединения"""
+    
+    def __init__(self, file: BinaryIO, *args, **kwargs):
+        self.file = file
+        super().__init__(*args, **kwargs)
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # Генератор мог так и не начаться (клиент ушел раньше), поэтому закрываем здесь, а не в нем
+            self.file.close()
+
+def file_range_response(path: Path, filename: str, media_type: str, range_header: Optional[str] = None) -> StreamingResponse:
+    """Отдача файла с поддержкой HTTP Range; файл открывается сразу, поэтому его можно удалить после вызова"""
+    return open_file_response(open(path, "rb"), filename, media_type, range_header)
+
+def open_file_response(file: BinaryIO, filename: str, media_type: str, range_header: Optional[str] = None) -> StreamingResponse:
+    """Отдача уже открытого файла с поддержкой HTTP Range; ответ закрывает файл сам"""
+    try:
+        status_code, headers, start, length = _range_headers(os.fstat(file.fileno()).st_size, filename, range_header)
+        return FileRangeResponse(
+            file,
+            _iter_file(file, start, length),
+            status_code=status_code,
+            media_type=media_type,
+            headers=headers
+        )
+    except BaseException:
+        file.close()
+        raise
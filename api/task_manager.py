@@ -1,81 +1,168 @@
 import os
 import asyncio
+import time
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Dict, Any, Optional, List
-from fastapi import UploadFile, HTTPException
-import io
-import zipfile
+from fastapi import HTTPException
 from .models.schemas import TaskStatus
 from .logging import CustomLogger
+from .config import Config
+from .result_store import result_store
+from .ingest import SpooledFile, upload_spool
+from .task_outputs import task_outputs
+from .task_store import TaskStore, create_task_store, is_worker_alive, WORKER_ID
+from .events import FINAL_STATUSES, task_events, task_snapshot
+from .webhooks import webhook_notifier
 
 class TaskManager:
     """Менеджер для управления асинхронными задачами"""
     
+    # Обращения к хранилищу выполняются вне event loop: при конкуренции воркеров за запись
+    # SQLite ждет блокировку до busy_timeout, и это не должно останавливать остальные запросы
+    
     _instance = None
-    _tasks: Dict[str, Dict[str, Any]] = {}
+    # Состояние задач в общем хранилище; загруженные файлы и логгер живут только в процессе-владельце
+    _store: Optional[TaskStore] = None
+    _runtime: Dict[str, Dict[str, Any]] = {}
+    _retired = False
     
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(TaskManager, cls).__new__(cls)
+            cls._store = create_task_store()
         return cls._instance
     
-    def create_task(self, white_bg: bool, files: List[UploadFile]) -> str:
+    def new_task_id(self) -> str:
+        """Выдает ID задачи до ее создания (нужен для каталога загрузок)"""
+        return str(uuid.uuid4())
+    
+    async def create_task(self, white_bg: bool, files: List[SpooledFile], concurrency: int, username: Optional[str] = None, task_id: Optional[str] = None, webhook_url: Optional[str] = None) -> str:
         """Создает новую задачу и возвращает её ID"""
-        task_id = str(uuid.uuid4())
+        task_id = task_id or self.new_task_id()
         
-        self._tasks[task_id] = {
+        await asyncio.to_thread(self._store.create, task_id, {
+            "username": username,
             "status": TaskStatus.PENDING,
             "white_bg": white_bg,
-            "files": files,
             "progress": 0,
             "processed_files": 0,
             "total_files": len(files),
+            "concurrency": concurrency,
             "start_time": datetime.now(),
             "end_time": None,
             "result": None,
             "error": None,
-            "logger": None
-        }
+            "webhook_url": webhook_url
+        })
+        self._runtime[task_id] = {"files": files, "logger": None}
         
         return task_id
     
-    def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+    async def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
         """Возвращает информацию о задаче"""
-        return self._tasks.get(task_id)
+        task = await asyncio.to_thread(self._store.get, task_id)
+        if task is None:
+            return None
+        task.update(self._runtime.get(task_id, {"files": [], "logger": None}))
+        return task
     
-    def update_task_status(self, task_id: str, status: TaskStatus, **kwargs):
+    async def list_tasks(self, username: Optional[str] = None, status: Optional[TaskStatus] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Возвращает задачи пользователя и/или с заданным статусом"""
+        return await asyncio.to_thread(self._store.list, username=username, status=status, limit=limit)
+    
+    async def update_task_status(self, task_id: str, status: TaskStatus, **kwargs):
         """Обновляет статус задачи"""
-        if task_id in self._tasks:
-            self._tasks[task_id]["status"] = status
-            for key, value in kwargs.items():
-                if key in self._tasks[task_id]:
-                    self._tasks[task_id][key] = value
-    
-    def set_task_result(self, task_id: str, zip_buffer: io.BytesIO):
-        """Сохраняет результат задачи"""
-        if task_id in self._tasks:
-            self._tasks[task_id]["result"] = zip_buffer
-            self._tasks[task_id]["end_time"] = datetime.now()
-    
-    def set_task_error(self, task_id: str, error: str):
+        runtime = self._runtime.get(task_id)
+        if runtime is not None:
+            for key in list(kwargs):
+                if key in runtime:
+                    runtime[key] = kwargs.pop(key)
+        await asyncio.to_thread(self._store.update, task_id, status=status, **kwargs)
+        await self._publish(task_id, status)
+    
+    async def set_task_result(self, task_id: str, result_key: str):
+        """Сохраняет ключ архива с результатом задачи в хранилище результатов"""
+        await asyncio.to_thread(self._store.update, task_id, result=result_key, end_time=datetime.now())
+    
+    async def set_task_error(self, task_id: str, error: str):
         """Сохраняет ошибку задачи"""
-        if task_id in self._tasks:
-            self._tasks[task_id]["error"] = error
-            self._tasks[task_id]["status"] = TaskStatus.FAILED
-            self._tasks[task_id]["end_time"] = datetime.now()
-    
-    def cleanup_old_tasks(self, max_age_hours: int = 24):
-        """Очищает старые задачи для экономии памяти"""
-        current_time = datetime.now()
-        tasks_to_remove = []
-        
-        for task_id, task_info in self._tasks.items():
-            if task_info["end_time"] and (current_time - task_info["end_time"]).total_seconds() > max_age_hours * 3600:
-                tasks_to_remove.append(task_id)
+        await asyncio.to_thread(
+            self._store.update, task_id, error=error, status=TaskStatus.FAILED, end_time=datetime.now()
+        )
+        await self._publish(task_id, TaskStatus.FAILED)
+    
+    async def _publish(self, task_id: str, status: TaskStatus):
+        """Рассылает состояние задачи подписчикам потока событий и webhook по завершении"""
+        final = status in FINAL_STATUSES
+        # Без подписчиков промежуточные обновления не перечитываются из хранилища
+        if not final and not task_events.has_subscribers(task_id):
+            return
+        task = await asyncio.to_thread(self._store.get, task_id)
+        if task is None:
+            return
+        snapshot = task_snapshot(task)
+        task_events.publish(task_id, "status", snapshot)
+        if final and task.get("webhook_url"):
+            webhook_notifier.notify(task["webhook_url"], {"event": f"task.{status.value}", **snapshot})
+    
+    async def cleanup_old_tasks(self, max_age_hours: int = 24):
+        """Очищает старые задачи и их архивы"""
+        cutoff = datetime.now() - timedelta(hours=max_age_hours)
         
-        for task_id in tasks_to_remove:
-            del self._tasks[task_id]
+        for task_info in await asyncio.to_thread(self._store.delete_finished_before, cutoff):
+            self._runtime.pop(task_info["task_id"], None)
+            await asyncio.to_thread(upload_spool.remove, task_info["task_id"])
+            await asyncio.to_thread(task_outputs.remove, task_info["task_id"])
+            if task_info["result"]:
+                result_store.delete(task_info["result"])
+    
+    async def heartbeat(self):
+        """Отмечает в хранилище, что этот воркер жив"""
+        if not self._retired:
+            await asyncio.to_thread(self._store.heartbeat, WORKER_ID)
+    
+    async def retire(self):
+        """При штатной остановке снимает отметку: ожидающие задачи воркера сразу заберут другие"""
+        self._retired = True
+        await asyncio.to_thread(self._store.retire, WORKER_ID)
+    
+    def _worker_dead(self, worker_id: Optional[str], heartbeats: Dict[str, float]) -> bool:
+        if not is_worker_alive(worker_id):
+            return True
+        # О воркерах других хостов судим по отметкам; отметки нет у штатно остановленного воркера
+        heartbeat = heartbeats.get(worker_id)
+        return heartbeat is None or time.time() - heartbeat > Config.TASK_STALE_SECONDS
+    
+    async def recover_interrupted_tasks(self) -> List[str]:
+        """Разбирает задачи завершившихся воркеров: ожидавшие очереди забирает себе и возвращает
+        для постановки в очередь, начатые помечает ошибкой"""
+        resumable = []
+        heartbeats = await asyncio.to_thread(self._store.worker_heartbeats)
+        for task_info in await asyncio.to_thread(self._store.list_unfinished):
+            task_id = task_info["task_id"]
+            # Задача живого воркера может долго ждать в его очереди: ее и ее загрузки не трогаем
+            if task_id in self._runtime or not self._worker_dead(task_info["worker_id"], heartbeats):
+                continue
+            
+            if task_info["status"] == TaskStatus.PENDING:
+                # Загрузки ожидавшей задачи на диске: ее можно выполнить здесь
+                files = await asyncio.to_thread(upload_spool.load, task_id)
+                if files is not None:
+                    if await asyncio.to_thread(self._store.claim, task_id, task_info["worker_id"]):
+                        self._runtime[task_id] = {"files": files, "logger": None}
+                        resumable.append(task_id)
+                    # Иначе задачу уже забрал другой воркер
+                    continue
+            
+            await self.set_task_error(task_id, "Task interrupted by worker restart")
+            await asyncio.to_thread(upload_spool.remove, task_id)
+        return resumable
+    
+    def release_inputs(self, task_id: str):
+        """Удаляет загруженные файлы и освобождает логгер завершенной задачи"""
+        self._runtime.pop(task_id, None)
+        upload_spool.remove(task_id)
 
 # Глобальный экземпляр менеджера задач
-task_manager = TaskManager()
\ No newline at end of file
+task_manager = TaskManager()
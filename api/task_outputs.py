@@ -0,0 +1,149 @@
+import asyncio
+import os
+import shutil
+import time
+import uuid
+import weakref
+import zipfile
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+from .config import Config
+from .metrics import zip_write_seconds
+from .streaming import zip_compression_for
+
+# Пустой ZIP (только запись конца центрального каталога)
+EMPTY_ZIP = b"PK\x05\x06" + b"\x00" * 18
+
+class TaskOutputStore:
+    """Готовые файлы задач по одному на диске: доступны, пока задача еще обрабатывается"""
+    
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        # Одну и ту же частичную сборку задачи не собираем параллельно для нескольких клиентов
+        self._partial_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+    
+    def task_dir(self, task_id: str) -> Path:
+        return self.root / task_id
+    
+    def _safe_name(self, name: str) -> str:
+        # Имя из загрузки может содержать каталоги; на диске - плоский список файлов
+        name = name.replace("/", "_").replace("\\", "_").lstrip(".")
+        return name or "file"
+    
+    def save(self, task_id: str, name: str, data: bytes) -> str:
+        """Сохраняет файл и возвращает его имя в задаче (синхронно)"""
+        directory = self.task_dir(task_id)
+        directory.mkdir(parents=True, exist_ok=True)
+        
+        # Файлы задачи пишет один обработчик по очереди, поэтому проверки наличия достаточно
+        name = self._safe_name(name)
+        stem, ext = os.path.splitext(name)
+        counter = 1
+        while (directory / name).exists():
+            name = f"{stem}_{counter}{ext}"
+            counter += 1
+        
+        # Временное имя с точкой не попадает в список: файл виден только целиком
+        tmp_path = directory / f".{name}.tmp"
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, directory / name)
+        return name
+    
+    async def put(self, task_id: str, name: str, data: bytes) -> str:
+        """Сохраняет файл вне event loop"""
+        return await asyncio.to_thread(self.save, task_id, name, data)
+    
+    def list(self, task_id: str) -> List[Dict[str, Any]]:
+        """Готовые файлы задачи в порядке завершения"""
+        files = []
+        try:
+            entries = list(os.scandir(self.task_dir(task_id)))
+        except FileNotFoundError:
+            return []
+        for entry in entries:
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            stat = entry.stat()
+            files.append({"name": entry.name, "size": stat.st_size, "completed_at": stat.st_mtime})
+        files.sort(key=lambda item: item["completed_at"])
+        return files
+    
+    def path(self, task_id: str, name: str) -> Optional[Path]:
+        """Путь к готовому файлу задачи; None, если такого файла нет"""
+        if not name or name != os.path.basename(name) or name.startswith("."):
+            return None
+        path = self.task_dir(task_id) / name
+        return path if path.is_file() else None
+    
+    def _build_partial(self, directory: Path, files: List[Dict[str, Any]], target: Path):
+        tmp_path = directory / f".partial-{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as zip_file:
+                for item in files:
+                    zip_file.write(directory / item["name"], item["name"], compress_type=zip_compression_for(item["name"]))
+            os.replace(tmp_path, target)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        
+        # Сборки с меньшим числом файлов устарели; уже начатые ответы держат файл открытым и удаления не замечают.
+        # Более новые (их мог собрать другой воркер) не трогаем
+        for path in directory.glob(".partial-*.zip"):
+            try:
+                count = int(path.stem.rsplit("-", 1)[1])
+            except ValueError:
+                continue
+            if count < len(files):
+                path.unlink(missing_ok=True)
+    
+    def _partial_zip(self, task_id: str) -> Tuple[BinaryIO, int]:
+        directory = self.task_dir(task_id)
+        while True:
+            if not directory.is_dir():
+                # Готовых файлов еще нет или они уже удалены: каталог заново не создаем
+                raise FileNotFoundError(directory)
+            files = self.list(task_id)
+            # Файлы задачи только добавляются, поэтому их число однозначно задает содержимое архива
+            target = directory / f".partial-{len(files)}.zip"
+            if not target.exists():
+                self._build_partial(directory, files, target)
+            try:
+                # Открываем здесь же: открытый файл переживает удаление сборки другим воркером
+                return open(target, "rb"), len(files)
+            except FileNotFoundError:
+                # Другой воркер успел собрать архив с новыми файлами и удалить этот: пересобираем по новому списку
+                continue
+    
+    async def partial_zip(self, task_id: str) -> Tuple[BinaryIO, int]:
+        """Открытый ZIP из готовых на этот момент файлов; пока новых файлов нет, отдается уже собранный.
+        FileNotFoundError, если у задачи нет каталога с файлами"""
+        lock = self._partial_locks.get(task_id)
+        if lock is None:
+            lock = self._partial_locks[task_id] = asyncio.Lock()
+        async with lock:
+            with zip_write_seconds.labels("partial").time():
+                return await asyncio.to_thread(self._partial_zip, task_id)
+    
+    def remove(self, task_id: str):
+        """Удаляет готовые файлы задачи"""
+        shutil.rmtree(self.task_dir(task_id), ignore_errors=True)
+
+def archive_files(archive: BinaryIO) -> List[Dict[str, Any]]:
+    """Файлы итогового архива в том же виде, что и TaskOutputStore.list"""
+    with archive, zipfile.ZipFile(archive) as zip_file:
+        return [
+            {"name": info.filename, "size": info.file_size, "completed_at": time.mktime(info.date_time + (0, 0, -1))}
+            for info in zip_file.infolist() if not info.is_dir()
+        ]
+
+def read_archive_file(archive: BinaryIO, name: str) -> Optional[bytes]:
+    """Содержимое файла из итогового архива; None, если такого файла нет"""
+    with archive, zipfile.ZipFile(archive) as zip_file:
+        try:
+            return zip_file.read(name)
+        except KeyError:
+            return None
+
+# Глобальное хранилище готовых файлов задач
+task_outputs = TaskOutputStore(Config.OUTPUTS_DIR)
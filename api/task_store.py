@@ -0,0 +1,244 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, Optional, List
+
+from .config import Config
+from .db import connect
+from .models.schemas import TaskStatus
+
+# Идентификатор воркера (хост, PID и метка запуска): по нему находятся задачи, прерванные перезапуском
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def is_worker_alive(worker_id: Optional[str]) -> bool:
+    """Проверяет, жив ли воркер; о воркерах на других хостах судить нельзя"""
+    if worker_id == WORKER_ID:
+        return True
+    try:
+        host, pid, _ = worker_id.rsplit(":", 2)
+        pid = int(pid)
+    except (AttributeError, ValueError):
+        return False
+    
+    if host != socket.gethostname():
+        return True
+    if pid == os.getpid():
+        # Тот же PID с другой меткой запуска: процесс был перезапущен
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class TaskStore:
+    """Интерфейс хранилища задач; операции рассчитаны на key-value бэкенды вроде Redis"""
+    
+    def create(self, task_id: str, record: Dict[str, Any]):
+        raise NotImplementedError
+    
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+    
+    def update(self, task_id: str, **fields) -> bool:
+        raise NotImplementedError
+    
+    def list(self, username: Optional[str] = None, status: Optional[TaskStatus] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+    
+    def delete_finished_before(self, cutoff: datetime) -> List[Dict[str, Any]]:
+        """Удаляет завершенные задачи старше cutoff и возвращает их записи"""
+        raise NotImplementedError
+    
+    def list_unfinished(self) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+    
+    def claim(self, task_id: str, previous_worker_id: Optional[str]) -> bool:
+        """Переназначает ожидающую задачу этому воркеру, если ее еще не забрал другой"""
+        raise NotImplementedError
+    
+    def heartbeat(self, worker_id: str):
+        """Отмечает, что воркер жив"""
+        raise NotImplementedError
+    
+    def retire(self, worker_id: str):
+        """Снимает отметку штатно остановленного воркера: его задачи сразу можно забирать"""
+        raise NotImplementedError
+    
+    def worker_heartbeats(self) -> Dict[str, float]:
+        """Время последней отметки каждого воркера"""
+        raise NotImplementedError
+
+class SQLiteTaskStore(TaskStore):
+    """Хранилище задач в SQLite, общее для всех воркеров и переживающее перезапуск"""
+    
+    FIELDS = (
+        "task_id", "username", "status", "white_bg", "concurrency", "progress",
+        "processed_files", "total_files", "start_time", "end_time", "result",
+        "error", "worker_id", "updated_at", "webhook_url"
+    )
+    DATETIME_FIELDS = ("start_time", "end_time")
+    
+    def __init__(self, db_path: Path):
+        self._lock = threading.Lock()
+        self._conn = connect(db_path)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                username TEXT,
+                status TEXT NOT NULL,
+                white_bg INTEGER NOT NULL,
+                concurrency INTEGER NOT NULL,
+                progress INTEGER NOT NULL DEFAULT 0,
+                processed_files INTEGER NOT NULL DEFAULT 0,
+                total_files INTEGER NOT NULL DEFAULT 0,
+                start_time TEXT,
+                end_time TEXT,
+                result TEXT,
+                error TEXT,
+                worker_id TEXT,
+                updated_at REAL NOT NULL,
+                webhook_url TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_username ON tasks (username, start_time);
+            CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, end_time);
+            CREATE TABLE IF NOT EXISTS workers (
+                worker_id TEXT PRIMARY KEY,
+                heartbeat REAL NOT NULL
+            );
+        """)
+        self._add_missing_columns({"webhook_url": "TEXT"})
+    
+    def _add_missing_columns(self, columns: Dict[str, str]):
+        """Дополняет таблицу базы, созданной прежней версией"""
+        existing = {row["name"] for row in self._conn.execute("PRAGMA table_info(tasks)")}
+        for name, column_type in columns.items():
+            if name in existing:
+                continue
+            try:
+                self._conn.execute(f"ALTER TABLE tasks ADD COLUMN {name} {column_type}")
+            except sqlite3.OperationalError:
+                # Колонку уже добавил другой воркер
+                pass
+    
+    def _encode(self, value: Any) -> Any:
+        if isinstance(value, datetime):
+            return value.isoformat()
+        if isinstance(value, TaskStatus):
+            return value.value
+        if isinstance(value, bool):
+            return int(value)
+        return value
+    
+    def _decode(self, row) -> Dict[str, Any]:
+        record = dict(row)
+        record["status"] = TaskStatus(record["status"])
+        record["white_bg"] = bool(record["white_bg"])
+        for key in self.DATETIME_FIELDS:
+            if record[key]:
+                record[key] = datetime.fromisoformat(record[key])
+        return record
+    
+    def create(self, task_id: str, record: Dict[str, Any]):
+        values = {key: record.get(key) for key in self.FIELDS}
+        values.update(task_id=task_id, worker_id=WORKER_ID, updated_at=time.time())
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO tasks ({', '.join(self.FIELDS)}) VALUES ({', '.join('?' for _ in self.FIELDS)})",
+                [self._encode(values[key]) for key in self.FIELDS]
+            )
+    
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return self._decode(row) if row else None
+    
+    def update(self, task_id: str, **fields) -> bool:
+        fields = {key: value for key, value in fields.items() if key in self.FIELDS and key != "task_id"}
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE tasks SET {assignments} WHERE task_id = ?",
+                [self._encode(value) for value in fields.values()] + [task_id]
+            )
+        return cursor.rowcount > 0
+    
+    def list(self, username: Optional[str] = None, status: Optional[TaskStatus] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        conditions, params = [], []
+        if username is not None:
+            conditions.append("username = ?")
+            params.append(username)
+        if status is not None:
+            conditions.append("status = ?")
+            params.append(self._encode(status))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM tasks {where} ORDER BY start_time DESC LIMIT ?", params + [limit]
+            ).fetchall()
+        return [self._decode(row) for row in rows]
+    
+    def delete_finished_before(self, cutoff: datetime) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT * FROM tasks WHERE end_time IS NOT NULL AND end_time < ?", (cutoff.isoformat(),)
+                ).fetchall()
+                self._conn.execute(
+                    "DELETE FROM tasks WHERE end_time IS NOT NULL AND end_time < ?", (cutoff.isoformat(),)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [self._decode(row) for row in rows]
+    
+    def list_unfinished(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM tasks WHERE status IN (?, ?)",
+                (TaskStatus.PENDING.value, TaskStatus.PROCESSING.value)
+            ).fetchall()
+        return [self._decode(row) for row in rows]
+    
+    def claim(self, task_id: str, previous_worker_id: Optional[str]) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE tasks SET worker_id = ?, updated_at = ? WHERE task_id = ? AND worker_id IS ? AND status = ?",
+                (WORKER_ID, time.time(), task_id, previous_worker_id, TaskStatus.PENDING.value)
+            )
+        return cursor.rowcount > 0
+    
+    def heartbeat(self, worker_id: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO workers (worker_id, heartbeat) VALUES (?, ?) "
+                "ON CONFLICT (worker_id) DO UPDATE SET heartbeat = excluded.heartbeat",
+                (worker_id, now)
+            )
+            # Записи давно остановленных воркеров: их задачи к этому времени уже восстановлены
+            self._conn.execute("DELETE FROM workers WHERE heartbeat < ?", (now - 86400,))
+    
+    def retire(self, worker_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+    
+    def worker_heartbeats(self) -> Dict[str, float]:
+        with self._lock:
+            rows = self._conn.execute("SELECT worker_id, heartbeat FROM workers").fetchall()
+        return {row["worker_id"]: row["heartbeat"] for row in rows}
+
+def create_task_store() -> TaskStore:
+    """Создает хранилище задач по конфигурации"""
+    return SQLiteTaskStore(Config.TASKS_DB_PATH)
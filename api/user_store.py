@@ -0,0 +1,277 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Any, Optional, List
+
+from .config import Config
+from .db import connect
+
+def hash_api_key(api_key: str) -> str:
+    """Ключи хранятся только в виде sha256: по утечке базы ключ не восстановить"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+class UserStore:
+    """Интерфейс хранилища пользователей"""
+    
+    FIELDS = (
+        "username", "api_key_hash", "is_admin", "created_at", "last_used",
+        "rate_limit", "priority", "is_active"
+    )
+    
+    def version(self) -> Any:
+        """Метка, меняющаяся при изменении пользователей (кроме last_used)"""
+        raise NotImplementedError
+    
+    def all(self) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+    
+    def get_by_key_hash(self, api_key_hash: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+    
+    def get_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+    
+    def create(self, record: Dict[str, Any]):
+        """Добавляет пользователя; ValueError, если имя уже занято"""
+        raise NotImplementedError
+    
+    def update(self, username: str, **fields) -> bool:
+        raise NotImplementedError
+    
+    def delete(self, username: str) -> bool:
+        raise NotImplementedError
+    
+    def touch(self, last_used: Dict[str, float]):
+        """Пакетно обновляет время последнего использования ключей"""
+        raise NotImplementedError
+
+class JSONUserStore(UserStore):
+    """Пользователи в JSON-файле (для одного воркера и небольшого числа ключей)"""
+    
+    def __init__(self, users_file: Path):
+        self.users_file = Path(users_file)
+        self._lock = threading.Lock()
+    
+    def _load(self) -> List[Dict[str, Any]]:
+        try:
+            with open(self.users_file, 'r', encoding='utf-8') as f:
+                users = json.load(f).get("users", [])
+        except (FileNotFoundError, json.JSONDecodeError):
+            return []
+        # Файлы старого формата хранят ключ в открытом виде
+        for user in users:
+            if "api_key_hash" not in user and user.get("api_key"):
+                user["api_key_hash"] = hash_api_key(user["api_key"])
+        return users
+    
+    def _save(self, users: List[Dict[str, Any]]):
+        tmp_file = self.users_file.with_name(self.users_file.name + ".tmp")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({"users": users}, f, indent=2, ensure_ascii=False)
+        # Атомарная замена: параллельные чтения не видят недописанный файл
+        os.replace(tmp_file, self.users_file)
+    
+    def version(self) -> Any:
+        try:
+            stat = os.stat(self.users_file)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+    
+    def all(self) -> List[Dict[str, Any]]:
+        return self._load()
+    
+    def get_by_key_hash(self, api_key_hash: str) -> Optional[Dict[str, Any]]:
+        return next((user for user in self._load() if user.get("api_key_hash") == api_key_hash), None)
+    
+    def get_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        return next((user for user in self._load() if user.get("username") == username), None)
+    
+    def create(self, record: Dict[str, Any]):
+        with self._lock:
+            users = self._load()
+            if any(user.get("username") == record["username"] for user in users):
+                raise ValueError(f"Пользователь {record['username']} уже существует")
+            users.append({key: record.get(key) for key in self.FIELDS})
+            self._save(users)
+    
+    def update(self, username: str, **fields) -> bool:
+        fields = {key: value for key, value in fields.items() if key in self.FIELDS and key != "username"}
+        with self._lock:
+            users = self._load()
+            for user in users:
+                if user.get("username") == username:
+                    user.update(fields)
+                    if "api_key_hash" in fields:
+                        user.pop("api_key", None)
+                    self._save(users)
+                    return True
+        return False
+    
+    def delete(self, username: str) -> bool:
+        with self._lock:
+            users = self._load()
+            remaining = [user for user in users if user.get("username") != username]
+            if len(remaining) == len(users):
+                return False
+            self._save(remaining)
+        return True
+    
+    def touch(self, last_used: Dict[str, float]):
+        with self._lock:
+            users = self._load()
+            for user in users:
+                timestamp = last_used.get(user.get("username"))
+                if timestamp is not None and timestamp > (user.get("last_used") or 0):
+                    user["last_used"] = timestamp
+            self._save(users)
+
+class SQLiteUserStore(UserStore):
+    """Пользователи в SQLite: общий доступ для всех воркеров, индексы по хэшу ключа и имени"""
+    
+    BOOL_FIELDS = ("is_admin", "is_active")
+    
+    def __init__(self, db_path: Path):
+        self._lock = threading.Lock()
+        self._conn = connect(db_path)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS users (
+                username TEXT NOT NULL,
+                api_key_hash TEXT NOT NULL,
+                is_admin INTEGER NOT NULL DEFAULT 0,
+                created_at REAL,
+                last_used REAL,
+                rate_limit INTEGER NOT NULL DEFAULT 100,
+                priority INTEGER NOT NULL DEFAULT 0,
+                is_active INTEGER NOT NULL DEFAULT 1
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users (username);
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_users_api_key_hash ON users (api_key_hash);
+            CREATE TABLE IF NOT EXISTS users_meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO users_meta (key, value) VALUES ('version', 0);
+        """)
+    
+    def _decode(self, row) -> Dict[str, Any]:
+        record = dict(row)
+        for key in self.BOOL_FIELDS:
+            record[key] = bool(record[key])
+        return record
+    
+    def _encode(self, value: Any) -> Any:
+        return int(value) if isinstance(value, bool) else value
+    
+    def _write(self, sql: str, params: List[Any]) -> int:
+        """Изменение пользователей и версии одной транзакцией"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self._conn.execute(sql, params)
+                if cursor.rowcount > 0:
+                    self._conn.execute("UPDATE users_meta SET value = value + 1 WHERE key = 'version'")
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return cursor.rowcount
+    
+    def version(self) -> Any:
+        with self._lock:
+            return self._conn.execute("SELECT value FROM users_meta WHERE key = 'version'").fetchone()[0]
+    
+    def all(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM users ORDER BY created_at").fetchall()
+        return [self._decode(row) for row in rows]
+    
+    def get_by_key_hash(self, api_key_hash: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM users WHERE api_key_hash = ?", (api_key_hash,)).fetchone()
+        return self._decode(row) if row else None
+    
+    def create(self, record: Dict[str, Any]):
+        try:
+            self._write(
+                f"INSERT INTO users ({', '.join(self.FIELDS)}) VALUES ({', '.join('?' for _ in self.FIELDS)})",
+                [self._encode(record.get(key)) for key in self.FIELDS]
+            )
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Пользователь {record['username']} уже существует")
+    
+    def update(self, username: str, **fields) -> bool:
+        fields = {key: value for key, value in fields.items() if key in self.FIELDS and key != "username"}
+        if not fields:
+            return self.get_by_username(username) is not None
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        return self._write(
+            f"UPDATE users SET {assignments} WHERE username = ?",
+            [self._encode(value) for value in fields.values()] + [username]
+        ) > 0
+    
+    def get_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+        return self._decode(row) if row else None
+    
+    def delete(self, username: str) -> bool:
+        return self._write("DELETE FROM users WHERE username = ?", [username]) > 0
+    
+    def touch(self, last_used: Dict[str, float]):
+        # last_used не меняет версию: индекс ключей из-за него не перестраивается
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "UPDATE users SET last_used = ? WHERE username = ? AND (last_used IS NULL OR last_used < ?)",
+                    [(timestamp, username, timestamp) for username, timestamp in last_used.items()]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+    
+    def import_users(self, users: List[Dict[str, Any]]) -> int:
+        """Переносит пользователей в пустую базу одной транзакцией; возвращает число перенесенных"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Проверка внутри транзакции: при старте нескольких воркеров перенос выполнит один
+                if self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]:
+                    self._conn.execute("ROLLBACK")
+                    return 0
+                self._conn.executemany(
+                    f"INSERT INTO users ({', '.join(self.FIELDS)}) VALUES ({', '.join('?' for _ in self.FIELDS)})",
+                    [[self._encode(user.get(key)) for key in self.FIELDS] for user in users]
+                )
+                self._conn.execute("UPDATE users_meta SET value = value + 1 WHERE key = 'version'")
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(users)
+
+def migrate_json_users(store: SQLiteUserStore, users_file: Path) -> int:
+    """Переносит пользователей из users.json в SQLite, если база еще пуста"""
+    users = [
+        {**user, "rate_limit": user.get("rate_limit", 100), "priority": user.get("priority", 0),
+         "is_admin": user.get("is_admin", False), "is_active": user.get("is_active", True)}
+        for user in JSONUserStore(users_file).all()
+        if user.get("username") and user.get("api_key_hash")
+    ]
+    if not users:
+        return 0
+    return store.import_users(users)
+
+def create_user_store() -> UserStore:
+    """Создает хранилище пользователей по конфигурации"""
+    if Config.USER_STORE_BACKEND == "json":
+        return JSONUserStore(Config.USERS_FILE)
+    
+    store = SQLiteUserStore(Config.USERS_DB_PATH)
+    migrate_json_users(store, Config.USERS_FILE)
+    return store
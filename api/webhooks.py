@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import socket
+from typing import Any, Dict, List, Optional, Set
+from urllib.parse import urlparse
+
+import aiohttp
+from aiohttp.abc import AbstractResolver, ResolveResult
+from aiohttp.resolver import DefaultResolver
+
+from .config import Config
+from .metrics import webhook_deliveries_total
+from .resilience import RETRYABLE_STATUSES, ResilientCaller, RetryableError, RetryPolicy, parse_retry_after
+
+class WebhookError(Exception):
+    """Постоянная ошибка доставки webhook (повтор не поможет)"""
+
+class WebhookURLError(ValueError):
+    """Адрес webhook недопустим (схема, хост вне списка или внутренний адрес)"""
+
+def is_public_address(address: str) -> bool:
+    """Публичный unicast-адрес: не loopback, не частная сеть, не link-local и т.п."""
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+def _host_allowlisted(host: str) -> bool:
+    return host.lower() in Config.WEBHOOK_ALLOWED_HOSTS
+
+async def validate_webhook_url(url: str):
+    """Проверяет адрес webhook; все адреса хоста должны быть публичными (защита от SSRF)"""
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise WebhookURLError("callback_url must be an http(s) URL")
+    
+    host = parsed.hostname
+    if Config.WEBHOOK_ALLOWED_HOSTS:
+        # Явный список хостов администратора заменяет проверку адресов
+        if not _host_allowlisted(host):
+            raise WebhookURLError(f"callback_url host {host} is not allowed")
+        return
+    if Config.WEBHOOK_ALLOW_PRIVATE:
+        return
+    
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, parsed.port or 0, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        raise WebhookURLError(f"callback_url host {host} cannot be resolved")
+    if not infos or not all(is_public_address(info[4][0]) for info in infos):
+        raise WebhookURLError(f"callback_url host {host} resolves to a non-public address")
+
+class PublicOnlyResolver(AbstractResolver):
+    """Резолвер сессии webhook: хост, сменивший адрес на внутренний после проверки, не соединится"""
+    
+    def __init__(self):
+        self._resolver = DefaultResolver()
+    
+    async def resolve(self, host: str, port: int = 0, family: socket.AddressFamily = socket.AF_INET) -> List[ResolveResult]:
+        results = await self._resolver.resolve(host, port, family)
+        if Config.WEBHOOK_ALLOW_PRIVATE or _host_allowlisted(host):
+            return results
+        if not all(is_public_address(result["host"]) for result in results):
+            raise OSError(f"{host} resolves to a non-public address")
+        return results
+    
+    async def close(self):
+        await self._resolver.close()
+
+class WebhookNotifier:
+    """Уведомления о завершении задач на callback_url клиента с повторами"""
+    
+    def __init__(self, attempts: int, timeout: float, secret: Optional[str] = None):
+        self.secret = secret
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        # Выключателя нет: адреса у клиентов разные, сбой одного не говорит о других
+        self._caller = ResilientCaller(RetryPolicy(
+            name="webhook",
+            attempts=max(1, attempts),
+            attempt_timeout=timeout,
+            base_delay=Config.RETRY_BASE_DELAY,
+            max_delay=Config.RETRY_MAX_DELAY
+        ))
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Ссылки на задачи доставки, чтобы их не собрал сборщик мусора и можно было дождаться при остановке
+        self._pending: Set[asyncio.Task] = set()
+        self._stats = {"delivered": 0, "failed": 0}
+    
+    def notify(self, url: str, payload: Dict[str, Any]):
+        """Ставит доставку в фон; вне event loop уведомление не отправляется"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(self._deliver(url, payload))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+    
+    async def _deliver(self, url: str, payload: Dict[str, Any]):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.secret:
+            headers["X-Signature"] = "sha256=" + hmac.new(self.secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+        try:
+            await self._caller.call(lambda: self._post(url, body, headers))
+        except Exception:
+            self._stats["failed"] += 1
+            webhook_deliveries_total.labels("failed").inc()
+        else:
+            self._stats["delivered"] += 1
+            webhook_deliveries_total.labels("delivered").inc()
+    
+    async def _post(self, url: str, body: bytes, headers: Dict[str, str]):
+        """Одна попытка; временные ошибки помечаются как RetryableError"""
+        # Повторная проверка при отправке: DNS мог измениться; IP-литералы резолвер не проходят
+        try:
+            await validate_webhook_url(url)
+        except WebhookURLError as e:
+            raise WebhookError(str(e)) from e
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(resolver=PublicOnlyResolver()),
+                timeout=self.timeout
+            )
+        try:
+            # Перенаправления не выполняем: иначе внутренний адрес можно указать в Location
+            async with self._session.post(url, data=body, headers=headers, allow_redirects=False) as response:
+                if response.status < 300:
+                    return
+                message = f"HTTP {response.status}"
+                if response.status in RETRYABLE_STATUSES:
+                    raise RetryableError(message, parse_retry_after(response.headers.get("Retry-After")))
+                raise WebhookError(message)
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError) as e:
+            raise RetryableError(f"Client error: {str(e)}") from e
+    
+    async def close(self, timeout: Optional[float] = None):
+        """Дожидается начатых доставок и закрывает сессию"""
+        if self._pending:
+            await asyncio.wait(set(self._pending), timeout=Config.WEBHOOK_TIMEOUT if timeout is None else timeout)
+            for task in self._pending:
+                task.cancel()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"pending": len(self._pending), **self._stats, "retries": self._caller.stats()["retries"]}
+
+# Глобальный отправитель webhook
+webhook_notifier = WebhookNotifier(Config.WEBHOOK_ATTEMPTS, Config.WEBHOOK_TIMEOUT, Config.WEBHOOK_SECRET)
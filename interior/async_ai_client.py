@@ -1,66 +1,120 @@
 import os
 import base64
 import io
-from openai import AsyncOpenAI
+import httpx
+import openai
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from PIL import Image
 import asyncio
 from typing import Tuple, Optional
 from api.logging import CustomLogger
+from api.resilience import RETRYABLE_STATUSES, default_retryable, parse_retry_after, upstream_callers
+from .config import Config
+from .classification_cache import ClassificationCache, ClassificationKey, classification_cache
+
+def openai_retryable(error: BaseException) -> Tuple[bool, Optional[float]]:
+    """Повторяем обрывы соединения, таймауты, 429 и 5xx"""
+    if isinstance(error, openai.APIConnectionError):
+        return True, None
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code in RETRYABLE_STATUSES:
+            return True, parse_retry_after(error.response.headers.get("retry-after"))
+        return False, None
+    return default_retryable(error)
 
 class AsyncAIClient:
     """Асинхронный клиент для работы с AI API"""
     
-    def __init__(self):
+    def __init__(self, cache: Optional[ClassificationCache] = None):
+        self.cache = cache or classification_cache
         self.client = AsyncOpenAI(
             api_key=os.getenv("OPENAI_API_KEY"),
-            base_url=os.getenv("BASE_URL")
+            base_url=os.getenv("BASE_URL"),
+            # Повторы и таймауты попыток выполняет upstream_callers
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=Config.MAX_CONNECTIONS,
+                    max_keepalive_connections=Config.MAX_KEEPALIVE_CONNECTIONS
+                ),
+                http2=Config.HTTP2
+            )
         )
     
-    async def analyze_thematic_subcategory(self, image_data: bytes, logger: CustomLogger) -> Tuple[str, str]:
-        """Асинхронно анализирует тематику товара"""
+    async def close(self):
+        """Закрывает пул соединений клиента"""
+        await self.client.close()
+    
+    async def cached_subcategory(self, image_data: bytes) -> Tuple[ClassificationKey, Optional[Tuple[str, str]]]:
+        """Ключ кэша классификации и найденная по нему категория (без обращения к API)"""
+        # Категория товара почти не меняется: повторные и похожие снимки берем из кэша
+        cache_key = await self.cache.make_key(image_data)
+        return cache_key, await self.cache.get(cache_key)
+    
+    async def analyze_thematic_subcategory(self, image_data: bytes, logger: CustomLogger, mime_type: str = "image/jpeg", cache_key: Optional[ClassificationKey] = None, owner: str = "default") -> Tuple[str, str]:
+        """Асинхронно анализирует тематику товара (cache_key - уже проверенный в кэше ключ, owner - задача для лимитера)"""
+        if cache_key is None:
+            cache_key, cached = await self.cached_subcategory(image_data)
+            if cached is not None:
+                return cached
+        
         base64_image = base64.b64encode(image_data).decode('utf-8')
         
         system_prompt = """Ты эксперт по категоризации товаров маркетплейса..."""  # ваш промпт
         
+        # Ошибки API после всех повторов пробрасываются: файл не должен молча получить чужую категорию
         try:
-            response = await self.client.chat.completions.create(
-                model=os.getenv("MODEL_NAME"),
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": [
-                        {"type": "text", "text": "Определи категорию и подкатегорию этого товара:"},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-                    ]}
-                ],
-                temperature=0.1,
-                max_tokens=100
+            response = await upstream_callers.get("chat").call(
+                lambda: self.client.chat.completions.create(
+                    model=os.getenv("MODEL_NAME"),
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": [
+                            {"type": "text", "text": "Определи категорию и подкатегорию этого товара:"},
+                            {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{base64_image}"}}
+                        ]}
+                    ],
+                    temperature=0.1,
+                    max_tokens=100
+                ),
+                logger,
+                openai_retryable,
+                owner
             )
-            
-            result = response.choices[0].message.content.strip()
-            if "|" in result:
-                return result.split("|")
-            else:
-                return "LIVING_ROOM", "DECOR"
-                
         except Exception as e:
             logger.error(f"Ошибка анализа категории: {e}")
-            return "LIVING_ROOM", "DECOR"
+            raise
+        
+        result = (response.choices[0].message.content or "").strip()
+        if "|" in result:
+            categories = result.split("|")
+            if len(categories) == 2:
+                await self.cache.put(cache_key, *categories)
+            return categories
+        
+        logger.warning(f"Неожиданный ответ классификации, используем категорию по умолчанию: {result!r}")
+        return "LIVING_ROOM", "DECOR"
     
-    async def edit_image_with_gemini(self, image_data: bytes, prompt: str, logger: CustomLogger) -> Optional[bytes]:
-        """Асинхронно генерирует изображение"""
+    async def edit_image_with_gemini(self, image_data: bytes, prompt: str, logger: CustomLogger, mime_type: str = "image/jpeg", owner: str = "default") -> Optional[bytes]:
+        """Асинхронно генерирует изображение (owner - задача для лимитера)"""
         base64_image = base64.b64encode(image_data).decode('utf-8')
         
         try:
-            response = await self.client.chat.completions.create(
-                model=os.getenv("IMAGE_MODEL"),
-                messages=[{
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-                    ]
-                }],
-                max_tokens=1000
+            response = await upstream_callers.get("image").call(
+                lambda: self.client.chat.completions.create(
+                    model=os.getenv("IMAGE_MODEL"),
+                    messages=[{
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": prompt},
+                            {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{base64_image}"}}
+                        ]
+                    }],
+                    max_tokens=1000
+                ),
+                logger,
+                openai_retryable,
+                owner
             )
             
             msg = response.choices[0].message
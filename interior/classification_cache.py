@@ -0,0 +1,255 @@
+import asyncio
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Tuple, Dict, Any, List, Set
+
+from PIL import Image
+
+from api.db import connect
+from api.cpu_executor import cpu_executor
+from .config import Config
+
+@dataclass
+class ClassificationKey:
+    """Ключ классификации: точный хэш содержимого и перцептивный хэш"""
+    sha256: str
+    phash: Optional[int]
+
+@dataclass
+class _Entry:
+    phash: Optional[int]
+    main_category: str
+    subcategory: str
+    created_at: float
+
+class ClassificationCache:
+    """Кэш результатов классификации с поиском по точному и перцептивному хэшу"""
+    
+    # Записи других воркеров дочитываются с перекрытием: запись с более ранним created_at
+    # может зафиксироваться позже (ожидание блокировки базы до 30 с)
+    REFRESH_OVERLAP_SECONDS = 60
+    
+    def __init__(self, db_path: Path, ttl_seconds: float, max_entries: int, phash_distance: int, enabled: bool = True):
+        self.db_path = Path(db_path)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.phash_distance = phash_distance
+        self.enabled = enabled
+        
+        self._entries: Optional["OrderedDict[str, _Entry]"] = None
+        # Хэш делится на phash_distance + 1 полос: у похожего снимка хотя бы одна полоса совпадает точно
+        self._bands = self._split_bands(phash_distance + 1)
+        self._buckets: List[Dict[int, Set[str]]] = [{} for _ in self._bands]
+        self._synced_at = 0.0
+        self._conn = None
+        self._lock = threading.Lock()
+        
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def perceptual_hash(image_data: bytes) -> Optional[int]:
+        """64-битный dHash: устойчив к пересжатию и небольшим изменениям кадра"""
+        try:
+            with Image.open(io.BytesIO(image_data)) as img:
+                # Для JPEG декодируем сразу в уменьшенном размере
+                img.draft("L", (64, 64))
+                pixels = list(img.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+        except Exception:
+            return None
+        
+        value = 0
+        for row in range(8):
+            for col in range(8):
+                left = pixels[row * 9 + col]
+                right = pixels[row * 9 + col + 1]
+                value = (value << 1) | (left > right)
+        return value
+    
+    @staticmethod
+    def _split_bands(count: int) -> List[Tuple[int, int]]:
+        """Сдвиг и маска каждой полосы 64-битного хэша"""
+        count = max(1, min(count, 64))
+        bands, shift = [], 0
+        for index in range(count):
+            width = 64 // count + (1 if index < 64 % count else 0)
+            bands.append((shift, (1 << width) - 1))
+            shift += width
+        return bands
+    
+    async def make_key(self, image_data: bytes) -> ClassificationKey:
+        """Вычисляет ключ классификации для изображения"""
+        phash = await cpu_executor.run(ClassificationCache.perceptual_hash, image_data)
+        return ClassificationKey(hashlib.sha256(image_data).hexdigest(), phash)
+    
+    def _load(self):
+        """Загружает неистекшие записи из SQLite при первом обращении"""
+        if self._entries is not None:
+            return
+        self._conn = connect(self.db_path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS classifications ("
+            "sha256 TEXT PRIMARY KEY, phash TEXT, main_category TEXT NOT NULL, "
+            "subcategory TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_classifications_created_at ON classifications (created_at)"
+        )
+        self._conn.execute(
+            "DELETE FROM classifications WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+        )
+        rows = self._conn.execute(
+            "SELECT * FROM classifications ORDER BY created_at DESC LIMIT ?", (self.max_entries,)
+        ).fetchall()
+        
+        self._entries = OrderedDict()
+        self._merge(reversed(rows))
+    
+    def _refresh(self):
+        """Дочитывает записи, которые с прошлой загрузки сохранили другие воркеры"""
+        rows = self._conn.execute(
+            "SELECT * FROM classifications WHERE created_at >= ? ORDER BY created_at",
+            (self._synced_at - self.REFRESH_OVERLAP_SECONDS,)
+        ).fetchall()
+        self._merge(rows)
+    
+    def _merge(self, rows):
+        for row in rows:
+            self._synced_at = max(self._synced_at, row["created_at"])
+            current = self._entries.get(row["sha256"])
+            if current is not None and current.created_at >= row["created_at"]:
+                continue
+            phash = int(row["phash"], 16) if row["phash"] else None
+            self._add(row["sha256"], _Entry(phash, row["main_category"], row["subcategory"], row["created_at"]))
+        
+        while len(self._entries) > self.max_entries:
+            self._discard(next(iter(self._entries)))
+    
+    def _add(self, sha: str, entry: _Entry):
+        self._discard(sha)
+        self._entries[sha] = entry
+        if entry.phash is not None:
+            for buckets, (shift, mask) in zip(self._buckets, self._bands):
+                buckets.setdefault((entry.phash >> shift) & mask, set()).add(sha)
+    
+    def _discard(self, sha: str) -> Optional[_Entry]:
+        entry = self._entries.pop(sha, None)
+        if entry is not None and entry.phash is not None:
+            for buckets, (shift, mask) in zip(self._buckets, self._bands):
+                band = (entry.phash >> shift) & mask
+                bucket = buckets.get(band)
+                if bucket is not None:
+                    bucket.discard(sha)
+                    if not bucket:
+                        del buckets[band]
+        return entry
+    
+    def _find(self, key: ClassificationKey, expires_before: float) -> Tuple[Optional[str], bool]:
+        entry = self._entries.get(key.sha256)
+        if entry is not None and entry.created_at >= expires_before:
+            return key.sha256, True
+        
+        if key.phash is None:
+            return None, False
+        
+        # Почти идентичный снимок того же товара: сравниваем только записи с совпавшей полосой
+        candidates = set()
+        for buckets, (shift, mask) in zip(self._buckets, self._bands):
+            candidates.update(buckets.get((key.phash >> shift) & mask, ()))
+        
+        best_sha, best_distance = None, self.phash_distance + 1
+        for sha in candidates:
+            candidate = self._entries[sha]
+            if candidate.created_at < expires_before:
+                continue
+            distance = (candidate.phash ^ key.phash).bit_count()
+            if distance < best_distance:
+                best_sha, best_distance = sha, distance
+        return best_sha, False
+    
+    def _lookup(self, key: ClassificationKey) -> Tuple[Optional[_Entry], bool]:
+        with self._lock:
+            self._load()
+            expires_before = time.time() - self.ttl_seconds
+            
+            sha, exact = self._find(key, expires_before)
+            if sha is None:
+                # Снимок мог уже классифицировать другой воркер
+                self._refresh()
+                sha, exact = self._find(key, expires_before)
+            if sha is None:
+                return None, False
+            
+            self._entries.move_to_end(sha)
+            return self._entries[sha], exact
+    
+    def _store(self, key: ClassificationKey, main_category: str, subcategory: str):
+        with self._lock:
+            self._load()
+            entry = _Entry(key.phash, main_category, subcategory, time.time())
+            self._add(key.sha256, entry)
+            
+            self._conn.execute(
+                "INSERT OR REPLACE INTO classifications VALUES (?, ?, ?, ?, ?)",
+                (
+                    key.sha256,
+                    format(key.phash, "016x") if key.phash is not None else None,
+                    main_category,
+                    subcategory,
+                    entry.created_at
+                )
+            )
+            
+            while len(self._entries) > self.max_entries:
+                evicted_sha = next(iter(self._entries))
+                self._discard(evicted_sha)
+                self._conn.execute("DELETE FROM classifications WHERE sha256 = ?", (evicted_sha,))
+    
+    async def get(self, key: ClassificationKey) -> Optional[Tuple[str, str]]:
+        """Возвращает сохраненную категорию изображения или None"""
+        if not self.enabled:
+            return None
+        
+        entry, exact = await asyncio.to_thread(self._lookup, key)
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        if exact:
+            self.exact_hits += 1
+        else:
+            self.similar_hits += 1
+        return entry.main_category, entry.subcategory
+    
+    async def put(self, key: ClassificationKey, main_category: str, subcategory: str):
+        """Сохраняет категорию изображения"""
+        if self.enabled:
+            await asyncio.to_thread(self._store, key, main_category, subcategory)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий кэша классификации"""
+        hits = self.exact_hits + self.similar_hits
+        lookups = hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries) if self._entries is not None else None
+        }
+
+# Глобальный кэш классификации
+classification_cache = ClassificationCache(
+    db_path=Config.CLASSIFICATION_CACHE_DB,
+    ttl_seconds=Config.CLASSIFICATION_CACHE_TTL_HOURS * 3600,
+    max_entries=Config.CLASSIFICATION_CACHE_MAX_ENTRIES,
+    phash_distance=Config.CLASSIFICATION_CACHE_PHASH_DISTANCE,
+    enabled=Config.CLASSIFICATION_CACHE_ENABLED
+)
@@ -13,11 +13,37 @@ class Config:
     BASE_URL = os.getenv("BASE_URL")
     PORADOCK_LOG_TOKEN_INTERIOR = os.getenv("PORADOCK_LOG_TOKEN_INTERIOR")
     
+    # Пул соединений с OpenAI-совместимым API (HTTP/2 требует пакет h2)
+    MAX_CONNECTIONS = int(os.getenv("AI_MAX_CONNECTIONS", "20"))
+    MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("AI_MAX_KEEPALIVE_CONNECTIONS", "10"))
+    HTTP2 = os.getenv("AI_HTTP2", "false").lower() == "true"
+    
+    # Подготовка изображений перед отправкой (0 - без ограничения размера)
+    GENERATION_MAX_EDGE = int(os.getenv("GENERATION_UPLOAD_MAX_EDGE", "1536"))
+    GENERATION_JPEG_QUALITY = int(os.getenv("GENERATION_UPLOAD_JPEG_QUALITY", "90"))
+    # Для классификации достаточно небольшой миниатюры
+    CLASSIFICATION_MAX_EDGE = int(os.getenv("CLASSIFICATION_UPLOAD_MAX_EDGE", "512"))
+    CLASSIFICATION_JPEG_QUALITY = int(os.getenv("CLASSIFICATION_UPLOAD_JPEG_QUALITY", "80"))
+    
+    # Конвейер задачи: классификация идет впереди генерации, очередь между стадиями ограничена
+    CLASSIFICATION_STAGE_WORKERS = int(os.getenv("CLASSIFICATION_STAGE_WORKERS", "4"))
+    PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+    
+    # Кэш классификации товаров
+    CLASSIFICATION_CACHE_ENABLED = os.getenv("CLASSIFICATION_CACHE_ENABLED", "true").lower() == "true"
+    CLASSIFICATION_CACHE_TTL_HOURS = float(os.getenv("CLASSIFICATION_CACHE_TTL_HOURS", "720"))
+    CLASSIFICATION_CACHE_MAX_ENTRIES = int(os.getenv("CLASSIFICATION_CACHE_MAX_ENTRIES", "50000"))
+    # Максимальное расстояние Хэмминга между перцептивными хэшами похожих снимков
+    CLASSIFICATION_CACHE_PHASH_DISTANCE = int(os.getenv("CLASSIFICATION_CACHE_PHASH_DISTANCE", "6"))
+    
     # Пути
     BASE_DIR = Path(__file__).parent.parent
     INPUT_DIR = BASE_DIR / "input"
     OUTPUT_DIR = BASE_DIR / "output_interior"
     TEMP_DIR = BASE_DIR / "temp_formatted"
+    CLASSIFICATION_CACHE_DB = Path(os.getenv(
+        "CLASSIFICATION_CACHE_DB", str(BASE_DIR / "temp_api" / "classification.db")
+    ))
     
     # Создание директорий
     INPUT_DIR.mkdir(exist_ok=True)
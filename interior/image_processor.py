@@ -1,3 +1,4 @@
+import io
 import os
 from PIL import Image, ExifTags
 from .config import Config
@@ -62,53 +63,41 @@ class ImageProcessor:
         
         has_left_right = width < new_width
         has_top_bottom = height < new_height
+        right_width = new_width - x_offset - width
+        bottom_height = new_height - y_offset - height
+        
+        # Поля заполняются растягиванием крайних строк/столбцов (NEAREST повторяет пиксель)
+        # вместо попиксельного putpixel
         
         # Заполняем левое и правое поля
         if has_left_right:
-            for y in range(height):
-                left_color = img.getpixel((0, y))
-                right_color = img.getpixel((width - 1, y))
-                
-                for x in range(x_offset):
-                    new_img.putpixel((x, y + y_offset), left_color)
-                
-                for x in range(x_offset + width, new_width):
-                    new_img.putpixel((x, y + y_offset), right_color)
+            if x_offset > 0:
+                left_edge = img.crop((0, 0, 1, height)).resize((x_offset, height), Image.NEAREST)
+                new_img.paste(left_edge, (0, y_offset))
+            if right_width > 0:
+                right_edge = img.crop((width - 1, 0, width, height)).resize((right_width, height), Image.NEAREST)
+                new_img.paste(right_edge, (x_offset + width, y_offset))
         
         # Заполняем верхнее и нижнее поля
         if has_top_bottom:
-            for x in range(width):
-                top_color = img.getpixel((x, 0))
-                bottom_color = img.getpixel((x, height - 1))
-                
-                for y in range(y_offset):
-                    new_img.putpixel((x + x_offset, y), top_color)
-                
-                for y in range(y_offset + height, new_height):
-                    new_img.putpixel((x + x_offset, y), bottom_color)
+            if y_offset > 0:
+                top_edge = img.crop((0, 0, width, 1)).resize((width, y_offset), Image.NEAREST)
+                new_img.paste(top_edge, (x_offset, 0))
+            if bottom_height > 0:
+                bottom_edge = img.crop((0, height - 1, width, height)).resize((width, bottom_height), Image.NEAREST)
+                new_img.paste(bottom_edge, (x_offset, y_offset + height))
         
         # Заполняем углы
         if has_left_right and has_top_bottom:
-            top_left_color = img.getpixel((0, 0))
-            top_right_color = img.getpixel((width - 1, 0))
-            bottom_left_color = img.getpixel((0, height - 1))
-            bottom_right_color = img.getpixel((width - 1, height - 1))
-            
-            for x in range(x_offset):
-                for y in range(y_offset):
-                    new_img.putpixel((x, y), top_left_color)
-            
-            for x in range(x_offset + width, new_width):
-                for y in range(y_offset):
-                    new_img.putpixel((x, y), top_right_color)
-            
-            for x in range(x_offset):
-                for y in range(y_offset + height, new_height):
-                    new_img.putpixel((x, y), bottom_left_color)
-            
-            for x in range(x_offset + width, new_width):
-                for y in range(y_offset + height, new_height):
-                    new_img.putpixel((x, y), bottom_right_color)
+            corners = (
+                ((0, 0), (0, 0, x_offset, y_offset)),
+                ((width - 1, 0), (x_offset + width, 0, new_width, y_offset)),
+                ((0, height - 1), (0, y_offset + height, x_offset, new_height)),
+                ((width - 1, height - 1), (x_offset + width, y_offset + height, new_width, new_height))
+            )
+            for source, box in corners:
+                if box[2] > box[0] and box[3] > box[1]:
+                    new_img.paste(img.getpixel(source), box)
         
         return new_img
 
@@ -166,6 +155,50 @@ class ImageProcessor:
             logger.error(f"Ошибка при приведении к формату 3:4 {input_path}: {str(e)}")
             return False
 
+    @staticmethod
+    def crop_to_3_4_jpeg(image_data, quality=95):
+        """Обрезает изображение до 3:4 и кодирует в JPEG (bytes -> bytes, для пула процессов)"""
+        with Image.open(io.BytesIO(image_data)) as image:
+            cropped_image = ImageProcessor.crop_to_3_4(image)
+            if cropped_image.mode != "RGB":
+                cropped_image = cropped_image.convert("RGB")
+            
+            output_buffer = io.BytesIO()
+            cropped_image.save(output_buffer, format="JPEG", quality=quality)
+            return output_buffer.getvalue()
+
+    @staticmethod
+    def prepare_for_upload(image_data, max_edge, quality):
+        """Уменьшает изображение по длинной стороне, применяет EXIF-ориентацию и перекодирует.
+        
+        Возвращает (данные, MIME-тип); если изменения не нужны, отдает исходные данные.
+        """
+        with Image.open(io.BytesIO(image_data)) as img:
+            source_format = img.format
+            orientation = ImageProcessor.get_image_orientation(img)
+            too_large = max_edge and max(img.size) > max_edge
+            
+            if not too_large and orientation == 1 and source_format in ("JPEG", "PNG"):
+                return image_data, f"image/{source_format.lower()}"
+            
+            if too_large:
+                # Для JPEG декодируем сразу в уменьшенном масштабе
+                img.draft(img.mode, (max_edge, max_edge))
+            image = ImageProcessor.apply_orientation(img, orientation)
+            if too_large:
+                image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            
+            output_buffer = io.BytesIO()
+            has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+            if has_alpha:
+                image.save(output_buffer, format="PNG")
+                return output_buffer.getvalue(), "image/png"
+            
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            image.save(output_buffer, format="JPEG", quality=quality)
+            return output_buffer.getvalue(), "image/jpeg"
+
     @staticmethod
     def save_image_simple(image, output_path, logger):
         """Простое сохранение изображения"""
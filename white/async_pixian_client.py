@@ -3,6 +3,11 @@ import asyncio
 from typing import Optional, Tuple
 import os
 from api.logging import CustomLogger
+from api.resilience import RETRYABLE_STATUSES, CircuitOpenError, RetryableError, parse_retry_after, upstream_callers
+from .config import Config
+
+class PixianError(Exception):
+    """Постоянная ошибка Pixian (повтор не поможет)"""
 
 class AsyncPixianClient:
     """Асинхронный клиент для Pixian.AI API"""
@@ -13,42 +18,81 @@ class AsyncPixianClient:
             login=os.getenv("PIXIAN_API_USER"),
             password=os.getenv("PIXIAN_API_KEY")
         )
-        self.timeout = aiohttp.ClientTimeout(total=120)
+        # Общий таймаут запроса; таймаут одной попытки задается политикой повторов
+        self.timeout = aiohttp.ClientTimeout(total=Config.TIMEOUT)
+        # Долгоживущая сессия: соединения с api.pixian.ai переиспользуются между изображениями
+        self._session: Optional[aiohttp.ClientSession] = None
+    
+    async def start(self) -> aiohttp.ClientSession:
+        """Создает сессию с пулом соединений (вызывается при старте приложения)"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=Config.CONNECTION_LIMIT,
+                keepalive_timeout=Config.KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=Config.DNS_CACHE_TTL
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
     
-    async def remove_background(self, image_data: bytes, logger: CustomLogger) -> Tuple[bool, Optional[bytes], Optional[str]]:
+    async def close(self):
+        """Закрывает сессию (вызывается при остановке приложения)"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def remove_background(self, image_data: bytes, logger: CustomLogger, content_type: str = "image/jpeg", owner: str = "default") -> Tuple[bool, Optional[bytes], Optional[str]]:
         """
         Асинхронно удаляет фон изображения
         
         Args:
             image_data: Данные изображения в bytes
             logger: Логгер для записи сообщений
+            content_type: MIME-тип изображения
+            owner: Владелец запроса (задача) для лимитера Pixian
             
         Returns:
             tuple: (success, image_data, error_message)
         """
+        caller = upstream_callers.get("pixian")
         try:
-            form_data = aiohttp.FormData()
-            form_data.add_field('image', image_data, filename='image.jpg', content_type='image/jpeg')
-            form_data.add_field('background.color', 'FFFFFF')
-            form_data.add_field('test', 'true')
-            
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                async with session.post(
-                    self.api_url,
-                    data=form_data,
-                    auth=self.auth
-                ) as response:
-                    
-                    if response.status == 200:
-                        processed_data = await response.read()
-                        return True, processed_data, None
-                    else:
-                        error_text = await response.text()
-                        return False, None, f"HTTP {response.status}: {error_text}"
-                        
+            processed_data = await caller.call(lambda: self._post(image_data, content_type), logger, owner=owner)
+            return True, processed_data, None
+        except (RetryableError, CircuitOpenError) as e:
+            return False, None, str(e)
+        except PixianError as e:
+            return False, None, str(e)
         except asyncio.TimeoutError:
             return False, None, "Request timeout"
         except aiohttp.ClientError as e:
             return False, None, f"Client error: {str(e)}"
         except Exception as e:
-            return False, None, f"Unexpected error: {str(e)}"
\ No newline at end of file
+            return False, None, f"Unexpected error: {str(e)}"
+    
+    async def _post(self, image_data: bytes, content_type: str) -> bytes:
+        """Одна попытка запроса; временные ошибки помечаются как RetryableError"""
+        form_data = aiohttp.FormData()
+        extension = 'png' if content_type == 'image/png' else 'jpg'
+        form_data.add_field('image', image_data, filename=f'image.{extension}', content_type=content_type)
+        form_data.add_field('background.color', Config.BACKGROUND_COLOR)
+        form_data.add_field('test', Config.TEST_MODE)
+        
+        session = await self.start()
+        try:
+            async with session.post(
+                self.api_url,
+                data=form_data,
+                auth=self.auth,
+                timeout=self.timeout
+            ) as response:
+                
+                if response.status == 200:
+                    return await response.read()
+                
+                error_text = await response.text()
+                message = f"HTTP {response.status}: {error_text}"
+                if response.status in RETRYABLE_STATUSES:
+                    raise RetryableError(message, parse_retry_after(response.headers.get("Retry-After")))
+                raise PixianError(message)
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError) as e:
+            # Обрыв соединения или недочитанный ответ - повторяем
+            raise RetryableError(f"Client error: {str(e)}") from e
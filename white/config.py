@@ -26,6 +26,15 @@ class Config:
     TEST_MODE = "true"
     TIMEOUT = 120
     
+    # Пул соединений
+    CONNECTION_LIMIT = int(os.getenv("PIXIAN_CONNECTION_LIMIT", "20"))
+    KEEPALIVE_TIMEOUT = float(os.getenv("PIXIAN_KEEPALIVE_TIMEOUT", "60"))
+    DNS_CACHE_TTL = int(os.getenv("PIXIAN_DNS_CACHE_TTL", "300"))
+    
+    # Подготовка изображения перед отправкой (0 - без ограничения размера)
+    UPLOAD_MAX_EDGE = int(os.getenv("PIXIAN_UPLOAD_MAX_EDGE", "3000"))
+    UPLOAD_JPEG_QUALITY = int(os.getenv("PIXIAN_UPLOAD_JPEG_QUALITY", "92"))
+    
     @classmethod
     def validate_config(cls):
         """Проверяет корректность конфигурации"""